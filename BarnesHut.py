@@ -0,0 +1,218 @@
+from typing import Tuple
+
+import numpy as np
+
+
+DEPTH = 30 # Positions are quantized to a 2^DEPTH x 2^DEPTH grid, which limits the depth of the tree. The keys take
+           # 2 * DEPTH bits. A few distant bodies make the grid coarse, so it has to be fine for a dense cluster to be split
+PAIR_BYTES = 96 # The memory a body-target pair of the opened leaves takes in the temporary arrays
+
+
+def interleave_bits(values: np.ndarray) -> np.ndarray:
+    # Spread the lower 32 bits of every value so that there is a zero bit between each two of them
+    values = values.astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    values = (values | (values << np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    values = (values | (values << np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+    values = (values | (values << np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    values = (values | (values << np.uint64(2))) & np.uint64(0x3333333333333333)
+    values = (values | (values << np.uint64(1))) & np.uint64(0x5555555555555555)
+    return values
+
+
+def ragged_arange(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    # Concatenation of arange(start, start + count) for every pair, without a Python loop
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.cumsum(counts) - counts
+    return np.repeat(starts - offsets, counts) + np.arange(total)
+
+
+class QuadTree(object):
+    # Linear quadtree stored as flat arrays. The bodies are sorted along the Morton (Z-order) curve, so every node
+    # owns a contiguous range [start, end) of the sorted bodies, and the children of a node are contiguous as well
+    def __init__(self, x: np.ndarray, y: np.ndarray, mass: np.ndarray, leaf_size: int = 8) -> None:
+        self.leaf_size = max(1, leaf_size)
+
+        # Find the square that contains every body
+        self.left = float(x.min()) if len(x) else 0.
+        self.top = float(y.min()) if len(y) else 0.
+        self.width = max(float(x.max()) - self.left, float(y.max()) - self.top) if len(x) else 0.
+        if self.width <= 0:
+            self.width = 1.
+        self.width *= 1 + 1e-9 # So that the bodies on the far edges still fall into the grid
+
+        cells = 1 << DEPTH
+        ix = np.minimum(((x - self.left) / self.width * cells).astype(np.int64), cells - 1)
+        iy = np.minimum(((y - self.top) / self.width * cells).astype(np.int64), cells - 1)
+        keys = interleave_bits(ix) | (interleave_bits(iy) << np.uint64(1))
+        self.order = np.argsort(keys, kind="stable")
+        keys = keys[self.order]
+        ix = ix[self.order]
+        iy = iy[self.order]
+        self.x = x[self.order]
+        self.y = y[self.order]
+        self.mass = mass[self.order]
+
+        # Prefix sums give the mass and the center of mass of any range of sorted bodies in O(1)
+        center_x, center_y = self.left + self.width / 2, self.top + self.width / 2 # Relative coordinates keep the sums precise
+        mass_sum = np.concatenate(([0.], np.cumsum(self.mass)))
+        moment_x = np.concatenate(([0.], np.cumsum(self.mass * (self.x - center_x))))
+        moment_y = np.concatenate(([0.], np.cumsum(self.mass * (self.y - center_y))))
+
+        # Build the tree level by level. On every level the sorted keys are cut into segments of equal prefixes,
+        # and a segment becomes a node if its parent was split
+        starts, ends, levels, parents = [], [], [], []
+        level_starts = np.zeros(1, dtype=np.int64)
+        level_ends = np.full(1, len(x), dtype=np.int64)
+        level_parents = np.full(1, -1, dtype=np.int64)
+        offset = 0
+        for level in range(DEPTH + 1):
+            starts.append(level_starts)
+            ends.append(level_ends)
+            levels.append(np.full(len(level_starts), level, dtype=np.int64))
+            parents.append(level_parents)
+            split = np.flatnonzero(level_ends - level_starts > self.leaf_size)
+            if level == DEPTH or len(split) == 0:
+                break
+            # Find the segments of the next level inside the split nodes
+            shift = np.uint64(2 * (DEPTH - level - 1))
+            inside = ragged_arange(level_starts[split], level_ends[split] - level_starts[split])
+            prefixes = keys[inside] >> shift
+            owners = np.repeat(split, level_ends[split] - level_starts[split])
+            new_segment = np.ones(len(inside), dtype=bool)
+            new_segment[1:] = (prefixes[1:] != prefixes[:-1]) | (owners[1:] != owners[:-1])
+            first = np.flatnonzero(new_segment)
+            next_starts = inside[first]
+            next_ends = np.append(inside[first[1:] - 1] + 1, inside[-1] + 1)
+            level_parents = offset + owners[first]
+            offset += len(level_starts)
+            level_starts, level_ends = next_starts, next_ends
+
+        self.start = np.concatenate(starts)
+        self.end = np.concatenate(ends)
+        self.level = np.concatenate(levels)
+        parent = np.concatenate(parents)
+        self.size = self.width / (1 << self.level).astype(np.float64) # The side of the node's square
+        self.box_x = self.left + (np.append(ix, 0)[self.start] >> (DEPTH - self.level)) * self.size # Its corner
+        self.box_y = self.top + (np.append(iy, 0)[self.start] >> (DEPTH - self.level)) * self.size
+
+        self.node_mass = mass_sum[self.end] - mass_sum[self.start]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.com_x = center_x + (moment_x[self.end] - moment_x[self.start]) / self.node_mass
+            self.com_y = center_y + (moment_y[self.end] - moment_y[self.start]) / self.node_mass
+        massless = self.node_mass == 0 # Nodes without mass attract nothing, any finite point will do
+        self.com_x[massless] = center_x
+        self.com_y[massless] = center_y
+
+        # The nodes are ordered by level and then by key, so the children of every node are contiguous
+        self.child_count = np.bincount(parent[1:], minlength=len(self.start)).astype(np.int64)
+        self.child_start = np.zeros(len(self.start), dtype=np.int64)
+        has_children = self.child_count > 0
+        self.child_start[has_children] = np.searchsorted(parent[1:], np.flatnonzero(has_children)) + 1
+
+    def __len__(self) -> int: # The number of nodes
+        return len(self.start)
+
+    def accelerations_at(self,
+                         tx: np.ndarray,
+                         ty: np.ndarray,
+                         theta: float,
+                         chunk: int = 4096,
+                         memory_budget: int = 16 * 1024 * 1024) -> Tuple[np.ndarray, np.ndarray]:
+        # Calculate the acceleration at the target points. A node is used as a whole if size / distance < theta,
+        # otherwise it is opened; opened leaves are summed body by body, in groups of pairs that fit into
+        # memory_budget bytes: the leaves at the depth limit may hold many bodies. Zero distances are masked out
+        ax = np.zeros(len(tx))
+        ay = np.zeros(len(tx))
+        if len(self.x) == 0:
+            return ax, ay
+        theta_squared = theta * theta
+        max_pairs = max(1, memory_budget // PAIR_BYTES)
+        for first in range(0, len(tx), chunk): # Limit the number of target-node pairs alive at the same time
+            chunk_x = tx[first:first + chunk]
+            chunk_y = ty[first:first + chunk]
+            chunk_ax = ax[first:first + chunk] # Views, the results are written straight into ax and ay
+            chunk_ay = ay[first:first + chunk]
+            targets = np.arange(len(chunk_x))
+            nodes = np.zeros(len(chunk_x), dtype=np.int64) # Every target starts at the root
+            while len(targets):
+                dx = self.com_x[nodes] - chunk_x[targets]
+                dy = self.com_y[nodes] - chunk_y[targets]
+                distance_squared = dx * dx + dy * dy
+                # A node is never used as a whole for a target inside of it, its center of mass may still be far
+                inside = ((chunk_x[targets] >= self.box_x[nodes]) & (chunk_x[targets] < self.box_x[nodes] + self.size[nodes]) &
+                          (chunk_y[targets] >= self.box_y[nodes]) & (chunk_y[targets] < self.box_y[nodes] + self.size[nodes]))
+                far = (self.size[nodes] ** 2 < theta_squared * distance_squared) & ~inside
+                accumulate(chunk_ax, chunk_ay, targets[far], dx[far], dy[far], distance_squared[far],
+                           self.node_mass[nodes[far]])
+
+                near = ~far
+                leaf = near & (self.child_count[nodes] == 0)
+                if leaf.any(): # Sum the bodies of the opened leaves directly
+                    leaf_nodes, leaf_targets = nodes[leaf], targets[leaf]
+                    counts = self.end[leaf_nodes] - self.start[leaf_nodes]
+                    ends = np.cumsum(counts)
+                    group = 0
+                    while group < len(counts): # The pairs of the next leaves that fit into the budget, at least one leaf
+                        last = max(int(np.searchsorted(ends, ends[group] - counts[group] + max_pairs, side="right")), group + 1)
+                        bodies = ragged_arange(self.start[leaf_nodes[group:last]], counts[group:last])
+                        pair_targets = np.repeat(leaf_targets[group:last], counts[group:last])
+                        dx = self.x[bodies] - chunk_x[pair_targets]
+                        dy = self.y[bodies] - chunk_y[pair_targets]
+                        accumulate(chunk_ax, chunk_ay, pair_targets, dx, dy, dx * dx + dy * dy, self.mass[bodies])
+                        group = last
+
+                opened = near & ~leaf # Replace the opened nodes with their children
+                counts = self.child_count[nodes[opened]]
+                nodes = ragged_arange(self.child_start[nodes[opened]], counts)
+                targets = np.repeat(targets[opened], counts)
+        return ax, ay
+
+
+def accumulate(ax: np.ndarray,
+               ay: np.ndarray,
+               targets: np.ndarray,
+               dx: np.ndarray,
+               dy: np.ndarray,
+               distance_squared: np.ndarray,
+               mass: np.ndarray) -> None:
+    # Add the attraction of point masses at (dx, dy) relative to the targets. Zero distances are masked out
+    if len(targets) == 0:
+        return
+    strength = distance_squared * np.sqrt(distance_squared) # |r| ^ 3
+    np.divide(mass, strength, out=strength, where=strength > 0)
+    ax += np.bincount(targets, weights=dx * strength, minlength=len(ax))
+    ay += np.bincount(targets, weights=dy * strength, minlength=len(ay))
+
+
+class BarnesHutSolver(object):
+    # Approximate O(N log N) solver: the tree is rebuilt over the current positions on every step
+    def __init__(self, theta: float = 0.5, leaf_size: int = 8, memory_budget: int = 16 * 1024 * 1024) -> None:
+        self.theta = theta
+        self.leaf_size = leaf_size
+        self.memory_budget = memory_budget # For the pairs of the opened leaves
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls(theta=float(config.get("barnes_hut_theta", 0.5)),
+                   leaf_size=int(config.get("barnes_hut_leaf_size", 8)),
+                   memory_budget=int(config.get("barnes_hut_memory_budget_mb", 16) * 1024 * 1024))
+
+    def accelerations_at(self,
+                         tx: np.ndarray,
+                         ty: np.ndarray,
+                         x: np.ndarray,
+                         y: np.ndarray,
+                         mass: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # The accelerations at arbitrary target points, e.g. a part of the bodies
+        return QuadTree(x, y, mass, self.leaf_size).accelerations_at(tx, ty, self.theta, memory_budget=self.memory_budget)
+
+    def accelerations(self, x: np.ndarray, y: np.ndarray, mass: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        tree = QuadTree(x, y, mass, self.leaf_size)
+        ax_sorted, ay_sorted = tree.accelerations_at(tree.x, tree.y, self.theta, memory_budget=self.memory_budget) # Sorted targets walk the tree coherently
+        ax = np.empty(len(x))
+        ay = np.empty(len(x))
+        ax[tree.order] = ax_sorted
+        ay[tree.order] = ay_sorted
+        return ax, ay
@@ -0,0 +1,134 @@
+import argparse
+import time
+from json import load
+from multiprocessing import cpu_count
+from typing import Tuple
+
+import numpy as np
+
+from Multipole import MultipoleSolver
+from Particle import Particle
+from ParticleStore import ParticleStore
+from Physics import DirectSolver, ParallelSolver
+from Profiler import FrameProfiler
+from SaveLoad import load_initial_state
+from Simulation import Simulation
+from Vector2D import Vector2D
+
+
+def random_disc(count: int, seed: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Bodies spread over a disc with the density growing towards the center, like in a disc collapse scenario
+    generator = np.random.default_rng(seed)
+    radius = 200 * generator.random(count) ** 2
+    angle = 2 * np.pi * generator.random(count)
+    return radius * np.cos(angle), radius * np.sin(angle), generator.uniform(1, 10, count)
+
+
+def load_bodies(filename: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    store = ParticleStore.from_particles(load_initial_state(filename))
+    return store.x, store.y, store.mass
+
+
+def time_solver(solver, x: np.ndarray, y: np.ndarray, mass: np.ndarray, repeats: int = 1):
+    # Returns the best time of several runs together with the result of the last one
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = solver.accelerations(x, y, mass)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def relative_errors(reference: Tuple[np.ndarray, np.ndarray], result: Tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    magnitude = np.hypot(reference[0], reference[1])
+    error = np.hypot(result[0] - reference[0], result[1] - reference[1])
+    return np.divide(error, magnitude, out=np.zeros(len(error)), where=magnitude > 0)
+
+
+def fmm_accuracy_report(x: np.ndarray,
+                        y: np.ndarray,
+                        mass: np.ndarray,
+                        orders=(2, 3, 4, 6, 8, 10),
+                        repeats: int = 1) -> None:
+    direct_time, reference = time_solver(DirectSolver(), x, y, mass, repeats)
+    print(f"{len(x)} bodies, direct sum: {direct_time:.3f} s")
+    print(f"{'order':>5} {'time, s':>9} {'speedup':>8} {'median error':>13} {'99% error':>10}")
+    for order in orders:
+        elapsed, result = time_solver(MultipoleSolver(order=order), x, y, mass, repeats)
+        errors = relative_errors(reference, result)
+        print(f"{order:>5} {elapsed:>9.3f} {direct_time / elapsed:>8.1f} "
+              f"{np.median(errors):>13.2e} {np.quantile(errors, 0.99):>10.2e}")
+
+
+def parallel_scaling_report(x: np.ndarray,
+                            y: np.ndarray,
+                            mass: np.ndarray,
+                            workers=None,
+                            repeats: int = 3) -> None:
+    if workers is None: # Powers of two up to the number of cores, and the number of cores itself
+        workers = sorted({2 ** i for i in range(cpu_count().bit_length()) if 2 ** i <= cpu_count()} | {cpu_count()})
+    serial_time, reference = time_solver(DirectSolver(), x, y, mass, repeats)
+    print(f"{len(x)} bodies, direct sum in this process: {serial_time:.3f} s")
+    print(f"{'workers':>7} {'time, s':>9} {'speedup':>8} {'efficiency':>10} {'max error':>10}")
+    for count in workers:
+        solver = ParallelSolver(workers=count)
+        solver.accelerations(x, y, mass) # Start the pool, so that its startup is not measured
+        elapsed, result = time_solver(solver, x, y, mass, repeats)
+        solver.close()
+        speedup = serial_time / elapsed
+        print(f"{count:>7} {elapsed:>9.3f} {speedup:>8.2f} {speedup / count:>10.0%} "
+              f"{relative_errors(reference, result).max():>10.2e}")
+
+
+def render_report(x: np.ndarray,
+                  y: np.ndarray,
+                  mass: np.ndarray,
+                  framesize: Tuple[int, int],
+                  config: dict,
+                  frames: int = 20) -> None:
+    # The time of every stage of drawing a frame with all the drawing options on. The bodies turn around the center
+    # instead of being simulated, so that every run draws the same frames; the painting in the GUI is timed there,
+    # with DRAWING.profile_frames
+    particles = [Particle(i + 1, Vector2D(x[i], y[i]), Vector2D(-y[i] / 100, x[i] / 100), mass[i], 1) for i in range(len(x))]
+    simulation = Simulation.for_drawing(particles, framesize, config)
+    profiler = simulation.profiler = FrameProfiler(enabled=True)
+    options = dict(draw_velocity_vectors=True, draw_barycenter=True, draw_trails=True, dependent_coloring=True,
+                   dependent_coloring_type="velocity")
+    simulation.render(**options).release() # The stamps of the bodies are made once, so that is not measured
+    profiler.reset()
+    store = simulation.store
+    for _ in range(frames):
+        store.x[:], store.y[:] = store.x - store.y / 100, store.y + store.x / 100
+        store.vx[:], store.vy[:] = -store.y / 100, store.x / 100
+        simulation.record_step()
+        with profiler.section("render"):
+            frame = simulation.render(**options)
+        frame.release()
+    print(f"{len(x)} bodies, {frames} frames of {framesize[0]}x{framesize[1]}")
+    print(profiler.report())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the physics backends and the drawing")
+    parser.add_argument("report", choices=["fmm", "parallel", "render"], help="The report to print")
+    parser.add_argument("--bodies", type=int, default=20000, help="The number of random bodies")
+    parser.add_argument("--load", help="Use the bodies from a save file instead of random ones")
+    parser.add_argument("--repeats", type=int, default=1, help="How many times every solver is run")
+    parser.add_argument("--workers", type=int, nargs="+", help="The numbers of worker processes to try")
+    parser.add_argument("--frames", type=int, default=20, help="The number of frames the render report draws")
+    parser.add_argument("--config", default="config.json", help="The config file of the render report")
+    arguments = parser.parse_args()
+
+    bodies = load_bodies(arguments.load) if arguments.load else random_disc(arguments.bodies)
+    match arguments.report:
+        case "fmm":
+            fmm_accuracy_report(*bodies, repeats=arguments.repeats)
+        case "parallel":
+            parallel_scaling_report(*bodies, workers=arguments.workers, repeats=arguments.repeats)
+        case "render":
+            with open(arguments.config) as f:
+                config = load(f)
+            render_report(*bodies,
+                          framesize=(int(config["SIMULATION"]["frame_size_x"]), int(config["SIMULATION"]["frame_size_y"])),
+                          config=config,
+                          frames=arguments.frames)
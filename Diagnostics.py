@@ -0,0 +1,24 @@
+from ParticleStore import ParticleStore
+from Vector2D import Vector2D
+
+
+class Diagnostics(object):
+    # Quantities of the whole system at one step. The total mass and momentum are conserved by the physics, so
+    # their drift over a run shows the error of the integrator
+    def __init__(self, step: int, total_mass: float, barycenter: Vector2D, momentum: Vector2D) -> None:
+        self.step = step
+        self.total_mass = total_mass
+        self.barycenter = barycenter # The average position weighted by mass
+        self.momentum = momentum
+
+    @classmethod
+    def from_store(cls, step: int, store: ParticleStore):
+        total_mass = float(store.mass.sum())
+        if total_mass > 0:
+            barycenter = Vector2D(float(store.x @ store.mass) / total_mass, float(store.y @ store.mass) / total_mass)
+        else:
+            barycenter = Vector2D(0., 0.)
+        return cls(step, total_mass, barycenter, Vector2D(float(store.vx @ store.mass), float(store.vy @ store.mass)))
+
+    def __repr__(self) -> str:
+        return f"Шаг {self.step}; M={self.total_mass}; XYc={repr(self.barycenter)}; P={repr(self.momentum)}"
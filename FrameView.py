@@ -0,0 +1,39 @@
+from PySide6.QtCore import QRect, QSize, Qt
+from PySide6.QtGui import QPainter
+from PySide6.QtWidgets import QFrame, QWidget
+
+from Frames import Frame
+from Profiler import FrameProfiler
+
+
+class FrameView(QFrame):
+    # Shows the frames of the simulation. The QImage of a frame is drawn straight into the widget, scaled once while
+    # it is painted to fit the widget with its aspect ratio kept, instead of being scaled and converted to a pixmap
+    # for a QLabel first. The shown frame goes back to its pool when the next one is shown
+    def __init__(self, parent: QWidget = None) -> None:
+        super(FrameView, self).__init__(parent)
+        self.frame = None
+        self.profiler = FrameProfiler() # The GUI sets the one of the simulation, to time the painting with its stages
+
+    def show_frame(self, frame: Frame) -> None:
+        previous, self.frame = self.frame, frame
+        if previous is not None and previous is not frame:
+            previous.release()
+        self.update()
+
+    def clear(self) -> None:
+        self.show_frame(None)
+
+    def paintEvent(self, event) -> None:
+        super(FrameView, self).paintEvent(event) # The panel around the frame
+        if self.frame is None:
+            return
+        with self.profiler.section("paint"):
+            image = self.frame.image
+            area = self.contentsRect()
+            size = QSize(image.width(), image.height()).scaled(area.size(), Qt.KeepAspectRatio)
+            # At the left and centered vertically, where a QLabel puts its pixmap
+            target = QRect(area.left(), area.top() + (area.height() - size.height()) // 2, size.width(), size.height())
+            painter = QPainter(self)
+            painter.drawImage(target, image)
+            painter.end()
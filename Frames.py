@@ -0,0 +1,77 @@
+from threading import Lock
+from typing import List, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING: # Qt is only imported when a frame is shown. Headless runs do not need it
+    from PySide6.QtGui import QImage
+
+
+class Frame(object):
+    # A drawn frame: the pixels of an image and a QImage on the same memory, so that showing it does not copy or
+    # convert it. The pixels of render are packed 0xFFRRGGBB, shape (height, width), which is QImage.Format_RGB32,
+    # the format Qt draws without converting. A frame from a pool goes back to it with release, after which its
+    # pixels are drawn over
+    def __init__(self, pixels: np.ndarray, pool: "FramePool" = None, index: int = -1) -> None:
+        self.pixels = pixels
+        self.pool = pool
+        self.index = index # Of the buffer in the pool
+        self.qimage = None
+
+    @classmethod
+    def from_rgb(cls, colors: np.ndarray):
+        # A frame of an RGB array of shape (height, width, 3), e.g. a heatmap. It does not belong to a pool
+        return cls(np.ascontiguousarray(colors))
+
+    @property
+    def image(self) -> "QImage":
+        # The QImage keeps a pointer to the pixels, which live as long as this frame or its pool
+        if self.qimage is None:
+            self.qimage = pixels_to_qimage(self.pixels)
+        return self.qimage
+
+    def release(self) -> None:
+        if self.pool is not None:
+            self.pool.release(self.index)
+            self.pool = None # A frame is released once
+
+
+class FramePool(object):
+    # The buffers render draws into, reused from frame to frame instead of allocating a new image every time. A buffer
+    # is taken by acquire and is not drawn into again until the frame is released: while the GUI shows one frame,
+    # the next one can be waiting for it and another one can be drawn, so three buffers are made in the usual case.
+    # Frames that are never released only make the pool allocate more. Used by the render and the GUI threads
+    def __init__(self, framesize: Tuple[int, int]) -> None:
+        self.width, self.height = framesize
+        self.buffers: List[np.ndarray] = []
+        self.images = [] # The QImage of every buffer, made once
+        self.free: List[int] = []
+        self.lock = Lock()
+
+    def acquire(self) -> Frame:
+        with self.lock:
+            if self.free:
+                index = self.free.pop()
+            else:
+                index = len(self.buffers)
+                self.buffers.append(np.zeros((self.height, self.width), dtype=np.uint32))
+                self.images.append(None)
+        frame = Frame(self.buffers[index], self, index)
+        if self.images[index] is None:
+            self.images[index] = frame.image
+        frame.qimage = self.images[index]
+        return frame
+
+    def release(self, index: int) -> None:
+        with self.lock:
+            self.free.append(index)
+
+
+def pixels_to_qimage(pixels: np.ndarray) -> "QImage":
+    # A QImage on the memory of packed RGB32 pixels of shape (height, width), or of RGB ones of shape
+    # (height, width, 3). The array has to live as long as the image
+    from PySide6.QtGui import QImage
+    height, width = pixels.shape[:2]
+    if pixels.ndim == 2:
+        return QImage(pixels.data, width, height, pixels.strides[0], QImage.Format.Format_RGB32)
+    return QImage(pixels.data, width, height, pixels.strides[0], QImage.Format.Format_RGB888)
@@ -0,0 +1,104 @@
+import time
+
+STARTED = time.perf_counter() # Before the other imports, so that the startup time includes them
+
+import argparse
+from json import load
+from multiprocessing import freeze_support
+
+import numpy as np
+
+from SaveLoad import load_initial_state, save_initial_state
+from Simulation import Simulation
+
+
+# Runs a simulation without the GUI, e.g. on a machine without a display. Nothing here imports Qt
+#
+#     python Headless.py saves/2_bodies_of_equal_mass.json --steps 10000 --backend barnes_hut --integrator leapfrog
+#         --output trajectory.npz --every 10 --final final.json
+
+
+def run(simulation: Simulation, steps: int, every: int) -> dict:
+    # Advance the simulation, keeping the state of every `every`-th step, the initial one included
+    snapshots = {"time": [], "positions": [], "velocities": [], "barycenter": [], "momentum": []}
+    add_snapshot(simulation, snapshots)
+    done = 0
+    while done < steps:
+        count = min(every, steps - done)
+        simulation.advance(count)
+        done += count
+        add_snapshot(simulation, snapshots)
+    return snapshots
+
+
+def add_snapshot(simulation: Simulation, snapshots: dict) -> None:
+    store = simulation.store
+    diagnostics = simulation.diagnostics()
+    snapshots["time"].append(simulation.time)
+    snapshots["positions"].append(store.positions())
+    snapshots["velocities"].append(np.stack((store.vx, store.vy), axis=1))
+    snapshots["barycenter"].append((diagnostics.barycenter.x, diagnostics.barycenter.y))
+    snapshots["momentum"].append((diagnostics.momentum.x, diagnostics.momentum.y))
+
+
+def save_trajectory(filename: str, simulation: Simulation, snapshots: dict) -> None:
+    # positions and velocities have the shape (snapshots, bodies, 2), the bodies are in the order of `id`. barycenter
+    # and momentum are those of the whole system, shape (snapshots, 2)
+    store = simulation.store
+    np.savez(filename,
+             time=np.array(snapshots["time"]),
+             positions=np.stack(snapshots["positions"]),
+             velocities=np.stack(snapshots["velocities"]),
+             barycenter=np.array(snapshots["barycenter"]),
+             momentum=np.array(snapshots["momentum"]),
+             id=store.id,
+             mass=store.mass,
+             radius=store.radius)
+
+
+if __name__ == "__main__":
+    freeze_support()
+    parser = argparse.ArgumentParser(description="Run a simulation without the GUI")
+    parser.add_argument("state", help="The initial state, a save file like saves/*.json")
+    parser.add_argument("--steps", type=int, default=1000, help="The number of steps to make")
+    parser.add_argument("--backend", help="The physics backend, the one from config.json by default")
+    parser.add_argument("--integrator", help="The integrator, the one from config.json by default")
+    parser.add_argument("--dt", type=float, help="The time step, the one from config.json by default")
+    parser.add_argument("--config", default="config.json", help="The config file")
+    parser.add_argument("--output", help="Write the trajectories to this .npz file")
+    parser.add_argument("--every", type=int, default=1, help="Keep every n-th step in the trajectories")
+    parser.add_argument("--stream", help="Stream every --every-th step to this .npy trajectory file while running")
+    parser.add_argument("--final", help="Write the final state to this save file, so that it can be loaded again")
+    arguments = parser.parse_args()
+
+    with open(arguments.config) as f:
+        config = load(f)
+    for key in ("backend", "integrator", "dt"): # The command line takes precedence over the config
+        if getattr(arguments, key) is not None:
+            config["SIMULATION"][key] = getattr(arguments, key)
+    config["SIMULATION"].update(history_length=0, history_decimated_length=0) # Nothing is drawn, only the current step is kept
+
+    simulation = Simulation(particles=load_initial_state(arguments.state),
+                            framesize=(int(config["SIMULATION"]["frame_size_x"]),
+                                       int(config["SIMULATION"]["frame_size_y"])),
+                            config=config)
+    if arguments.stream:
+        simulation.stream_to(arguments.stream, max(arguments.every, 1))
+    startup = time.perf_counter() - STARTED
+
+    start = time.perf_counter()
+    snapshots = run(simulation, arguments.steps, max(arguments.every, 1))
+    simulation.close()
+    elapsed = time.perf_counter() - start
+
+    if arguments.output:
+        save_trajectory(arguments.output, simulation, snapshots)
+    if arguments.final:
+        save_initial_state(simulation.particles, arguments.final)
+
+    print(f"{len(simulation.store)} bodies, {arguments.steps} steps of {simulation.dt} "
+          f"with {config['SIMULATION'].get('backend', 'direct')} and {config['SIMULATION'].get('integrator', 'euler')}")
+    first, last = np.array(snapshots["momentum"][0]), np.array(snapshots["momentum"][-1])
+    print(f"Total mass: {simulation.diagnostics().total_mass}, momentum drift: {np.hypot(*(last - first)):.3e}")
+    print(f"Startup: {startup:.3f} s")
+    print(f"Simulation: {elapsed:.3f} s, {arguments.steps / elapsed if elapsed > 0 else float('inf'):.1f} steps/s")
@@ -0,0 +1,234 @@
+import hashlib
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import cpu_count, get_context
+from threading import Event, Lock
+from typing import Callable, Iterator, List, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+from Kernels import NUMBA_AVAILABLE, force_field, potential_field
+from Multipole import MultipoleSolver
+
+if TYPE_CHECKING:
+    from Simulation import Simulation
+
+
+HEATMAP_DIRECT_LIMIT = 256 # With more bodies the heatmap is evaluated with the multipole method, if it is "auto"
+
+
+def uses_multipole(method: str, count: int) -> bool:
+    return method == "multipole" or (method == "auto" and count > HEATMAP_DIRECT_LIMIT)
+
+
+def bodies_field(pixel_x: np.ndarray,
+                 pixel_y: np.ndarray,
+                 x: np.ndarray,
+                 y: np.ndarray,
+                 mass: np.ndarray,
+                 radius: np.ndarray,
+                 potential: bool,
+                 solver: MultipoleSolver = None) -> np.ndarray:
+    # The value shown by the heatmap on the grid pixel_x x pixel_y, shape (len(pixel_x), len(pixel_y)), summed over
+    # the bodies: exactly, or with the multipole solver if it is given
+    if solver is not None:
+        grid_x, grid_y = np.meshgrid(pixel_x, pixel_y, indexing="ij")
+        field = solver.field_at(grid_x.ravel(), grid_y.ravel(), x, y, mass, radius=radius, potential=potential)
+        if potential:
+            return -field[:, 2].reshape(grid_x.shape)
+        return np.hypot(field[:, 0], field[:, 1]).reshape(grid_x.shape)
+    if potential:
+        return -potential_field(pixel_x, pixel_y, x, y, mass, radius)
+    return force_field(pixel_x, pixel_y, x, y, mass, radius)
+
+
+worker_solvers = {} # The multipole solvers of a worker process by their order, reused between the tiles
+
+
+def initialize_worker() -> None:
+    # The pool already uses every core, so the compiled kernels of a worker run on one thread
+    if NUMBA_AVAILABLE:
+        import numba
+        numba.set_num_threads(1)
+
+
+def tile_worker(tile: Tuple[int, int, int, int],
+                pixel_x: np.ndarray,
+                pixel_y: np.ndarray,
+                bodies: Tuple[np.ndarray, ...],
+                potential: bool,
+                order: int) -> Tuple[Tuple[int, int, int, int], np.ndarray]:
+    # Runs in a worker process: the field of one tile. order is 0 for the exact sum
+    solver = None
+    if order > 0:
+        if order not in worker_solvers:
+            worker_solvers[order] = MultipoleSolver(order=order)
+        solver = worker_solvers[order]
+    return tile, bodies_field(pixel_x, pixel_y, *bodies, potential=potential, solver=solver)
+
+
+def release_executor(resources: dict) -> None:
+    if resources["executor"] is not None:
+        resources["executor"].shutdown(wait=False, cancel_futures=True)
+
+
+class HeatmapPool(object):
+    # The worker processes the heatmap tiles are computed in, one per core by default. They are started on the first
+    # heatmap and kept for the next ones
+    def __init__(self, workers: int = 0) -> None:
+        self.workers = workers if workers > 0 else cpu_count()
+        self.resources = {"executor": None}
+        weakref.finalize(self, release_executor, self.resources) # Stop the workers when the pool is not used anymore
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls(workers=int(config.get("heatmap_workers", 0)))
+
+    def executor(self) -> ProcessPoolExecutor:
+        if self.resources["executor"] is None: # Forking a process that has run the compiled kernels on threads is unsafe
+            self.resources["executor"] = ProcessPoolExecutor(self.workers, mp_context=get_context("spawn"),
+                                                             initializer=initialize_worker)
+        return self.resources["executor"]
+
+    def close(self) -> None:
+        release_executor(self.resources)
+        self.resources["executor"] = None
+
+
+class HeatmapCache(object):
+    # The finished heatmaps by the key of their job, the least recently used ones are dropped when they take more than
+    # the memory cap. Used by the GUI thread and the job threads
+    def __init__(self, capacity: int = 64 * 1024 * 1024) -> None:
+        self.capacity = capacity # In bytes
+        self.size = 0
+        self.frames = OrderedDict()
+        self.lock = Lock()
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls(capacity=int(config.get("heatmap_cache_mb", 64) * 1024 * 1024))
+
+    def get(self, key: str) -> np.ndarray:
+        # The cached frame, or None
+        with self.lock:
+            frame = self.frames.get(key)
+            if frame is not None:
+                self.frames.move_to_end(key)
+            return frame
+
+    def put(self, key: str, frame: np.ndarray) -> None:
+        if frame.nbytes > self.capacity:
+            return
+        with self.lock:
+            if key in self.frames:
+                self.size -= self.frames.pop(key).nbytes
+            self.frames[key] = frame
+            self.size += frame.nbytes
+            while self.size > self.capacity:
+                self.size -= self.frames.popitem(last=False)[1].nbytes
+
+
+class HeatmapJob(object):
+    # The heatmap of one moment of a simulation, computed tile by tile on the pool, so that the GUI stays responsive
+    # and shows the tiles as they are done. A coarse version is computed first: it is shown under the missing tiles
+    # and its range colors the tiles until the exact range of the whole frame is known
+    def __init__(self, simulation: "Simulation", pool: HeatmapPool, cache: HeatmapCache = None) -> None:
+        drawing = simulation.config["DRAWING"]
+        store = simulation.store
+        self.simulation = simulation
+        self.pool = pool
+        self.cache = cache
+        self.levels = max(1, int(drawing.get("heatmap_levels", 4)))
+        self.tile_size = max(1, int(drawing.get("heatmap_tile_size", 128)))
+        self.potential = drawing.get("heatmap_field", "force") == "potential"
+        self.order = 0 # The order of the multipole method, 0 for the exact sum
+        if uses_multipole(drawing.get("heatmap_method", "auto"), len(store)):
+            self.order = int(drawing.get("heatmap_fmm_order", 4))
+        self.local = simulation.samples_heatmap() # The particle-mesh grid is sampled here, there is nothing to split
+        self.bodies = (store.x.copy(), store.y.copy(), store.mass.copy(), store.radius.copy()) # The simulation goes on
+        self.key = self.make_key(drawing)
+        self.cancelled = Event()
+        self.futures = []
+
+    def make_key(self, drawing: dict) -> str:
+        # A hash of everything the finished frame depends on: the bodies, the frame size and the heatmap options
+        digest = hashlib.blake2b(digest_size=16)
+        for array in self.bodies:
+            digest.update(array.tobytes())
+        digest.update(repr((self.simulation.framesize,
+                            type(self.simulation.solver).__name__ if self.local else None,
+                            self.potential,
+                            self.order,
+                            drawing["heatmap_gradient_color_0"],
+                            drawing["heatmap_gradient_color_1"])).encode())
+        return digest.hexdigest()
+
+    def cancel(self) -> None:
+        # Tiles that are not started yet are dropped, the ones being computed are ignored when they are done
+        self.cancelled.set()
+        for future in self.futures:
+            future.cancel()
+
+    def tiles(self) -> List[Tuple[int, int, int, int]]:
+        # (left, top, right, bottom) of the tiles in pixels. Every multipole tile builds a tree of all the bodies,
+        # so there are only as many of them as there are workers
+        width, height = self.simulation.framesize
+        size = self.tile_size
+        if self.order > 0:
+            size = max(size, int(np.ceil(np.sqrt(width * height / self.pool.workers))))
+        return [(left, top, min(left + size, width), min(top + size, height))
+                for top in range(0, height, size) for left in range(0, width, size)]
+
+    def run(self, publish: Callable[[np.ndarray], None]) -> None:
+        # Runs in a background thread. publish gets the frame, an RGB array of shape (height, width, 3), after the
+        # coarse version and after every tile. It is not called anymore once the job is cancelled
+        if self.cache is not None:
+            frame = self.cache.get(self.key)
+            if frame is not None: # Shown again without a change
+                publish(frame)
+                return
+        simulation = self.simulation
+        width, height = simulation.framesize
+        pixel_x = np.arange(width, dtype=np.float64) - width // 2 # The pixels in simulation coordinates
+        pixel_y = np.arange(height, dtype=np.float64) - height // 2
+
+        stride = 2 ** (self.levels - 1)
+        coarse = simulation.heatmap_field(pixel_x[stride // 2::stride], pixel_y[stride // 2::stride])
+        value_range = (float(coarse.min()), float(coarse.max()))
+        rows = np.minimum(np.arange(height) // stride, coarse.shape[1] - 1) # The coarse pixel every pixel is in
+        columns = np.minimum(np.arange(width) // stride, coarse.shape[0] - 1)
+        frame = simulation.heatmap_colors(coarse)[rows[:, np.newaxis], columns[np.newaxis, :]]
+        if self.cancelled.is_set():
+            return
+        publish(frame.copy())
+
+        field = np.zeros((width, height))
+        if self.local:
+            done = (((left, top, right, bottom), simulation.heatmap_field(pixel_x[left:right], pixel_y[top:bottom]))
+                    for left, top, right, bottom in self.tiles())
+        else:
+            done = self.computed_tiles(pixel_x, pixel_y)
+        for (left, top, right, bottom), tile_field in done:
+            if self.cancelled.is_set():
+                return
+            field[left:right, top:bottom] = tile_field
+            frame[top:bottom, left:right] = simulation.heatmap_colors(tile_field, value_range)
+            publish(frame.copy())
+        if not self.cancelled.is_set():
+            frame = simulation.heatmap_colors(field) # With the exact range
+            if self.cache is not None:
+                self.cache.put(self.key, frame)
+            publish(frame)
+
+    def computed_tiles(self, pixel_x: np.ndarray, pixel_y: np.ndarray) -> Iterator[Tuple[Tuple[int, int, int, int], np.ndarray]]:
+        # The tiles and their fields in the order the workers finish them
+        executor = self.pool.executor()
+        self.futures = [executor.submit(tile_worker, tile, pixel_x[tile[0]:tile[2]], pixel_y[tile[1]:tile[3]],
+                                        self.bodies, self.potential, self.order) for tile in self.tiles()]
+        if self.cancelled.is_set(): # Cancelled while the tiles were submitted
+            self.cancel()
+        for future in as_completed(self.futures):
+            if self.cancelled.is_set():
+                return
+            yield future.result()
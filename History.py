@@ -0,0 +1,155 @@
+from typing import List, Tuple
+
+import numpy as np
+
+from ParticleStore import ParticleStore
+
+
+class RingBuffer(object):
+    # The last `capacity` records of the positions, velocities and accelerations of the bodies, in arrays of shape
+    # (capacity, bodies, 2) allocated once. Record number n is kept in the row n % capacity, over the oldest one
+    def __init__(self, capacity: int, count: int) -> None:
+        self.capacity = capacity
+        self.written = 0 # The number of records pushed so far
+        self.steps = np.zeros(capacity, dtype=np.int64) # The step every record was made at
+        self.positions = np.zeros((capacity, count, 2))
+        self.velocities = np.zeros((capacity, count, 2))
+        self.accelerations = np.zeros((capacity, count, 2))
+
+    def __len__(self) -> int:
+        return min(self.written, self.capacity)
+
+    def clear(self) -> None:
+        self.written = 0
+
+    def push(self, step: int, store: ParticleStore) -> None:
+        if self.capacity == 0:
+            return
+        row = self.written % self.capacity
+        self.steps[row] = step
+        self.positions[row, :, 0], self.positions[row, :, 1] = store.x, store.y
+        self.velocities[row, :, 0], self.velocities[row, :, 1] = store.vx, store.vy
+        self.accelerations[row, :, 0], self.accelerations[row, :, 1] = store.ax, store.ay
+        self.written += 1
+
+    def push_record(self, step: int, positions: np.ndarray, velocities: np.ndarray, accelerations: np.ndarray) -> None:
+        # The same as push, for a record that is already in the (bodies, 2) arrays
+        if self.capacity == 0:
+            return
+        row = self.written % self.capacity
+        self.steps[row] = step
+        self.positions[row] = positions
+        self.velocities[row] = velocities
+        self.accelerations[row] = accelerations
+        self.written += 1
+
+    def extend(self, steps: np.ndarray, positions: np.ndarray, velocities: np.ndarray, accelerations: np.ndarray) -> None:
+        # The same as push_record for several records at once, arrays of shape (records, bodies, 2). Only the ones
+        # that fit are copied
+        if self.capacity == 0 or len(steps) == 0:
+            return
+        kept = min(len(steps), self.capacity)
+        rows = (self.written + len(steps) - kept + np.arange(kept)) % self.capacity
+        self.steps[rows] = steps[-kept:]
+        self.positions[rows] = positions[-kept:]
+        self.velocities[rows] = velocities[-kept:]
+        self.accelerations[rows] = accelerations[-kept:]
+        self.written += len(steps)
+
+    def resized(self, capacity: int) -> "RingBuffer":
+        # A ring of another capacity with the newest of these records
+        ring = RingBuffer(capacity, self.positions.shape[1])
+        if len(self):
+            ring.extend(*(np.concatenate(self.segments(array)) for array in
+                          (self.steps, self.positions, self.velocities, self.accelerations)))
+        return ring
+
+    def last(self, array: np.ndarray) -> np.ndarray:
+        # The newest record of one of the arrays, a view
+        return array[(self.written - 1) % self.capacity]
+
+    def segments(self, array: np.ndarray, stop: int = None) -> List[np.ndarray]:
+        # The records of one of the arrays from the oldest one, in chronological order, as one or two views. Only the
+        # first `stop` of them if it is given
+        count = len(self) if stop is None else min(stop, len(self))
+        if count == 0:
+            return []
+        first = (self.written - len(self)) % self.capacity # The row of the oldest record
+        end = first + count
+        if end <= self.capacity:
+            return [array[first:end]]
+        return [array[first:], array[:end - self.capacity]]
+
+
+class History(object):
+    # The recent steps at full resolution and every `decimation`-th step for a longer time before them, so that the
+    # memory does not grow with the length of the run. The newest step is always kept. Without `allocated` only that
+    # one is kept until allocate is called, e.g. by a drawing that does not know yet if it draws the trails
+    def __init__(self, count: int, length: int = 1000, decimation: int = 10, decimated_length: int = 1000,
+                 allocated: bool = True) -> None:
+        self.decimation = max(decimation, 1)
+        self.length = max(length, 1)
+        self.decimated_length = max(decimated_length, 0)
+        self.recent = RingBuffer(self.length if allocated else 1, count)
+        self.older = RingBuffer(self.decimated_length if allocated else 0, count)
+
+    @classmethod
+    def from_config(cls, count: int, config: dict, allocated: bool = True):
+        return cls(count,
+                   length=int(config.get("history_length", 1000)),
+                   decimation=int(config.get("history_decimation", 10)),
+                   decimated_length=int(config.get("history_decimated_length", 1000)),
+                   allocated=allocated)
+
+    def allocate(self) -> None:
+        # Grow the rings to their full length, keeping the records they have
+        if self.recent.capacity < self.length:
+            self.recent = self.recent.resized(self.length)
+        if self.older.capacity < self.decimated_length:
+            self.older = self.older.resized(self.decimated_length)
+
+    def record(self, step: int, store: ParticleStore) -> None:
+        self.recent.push(step, store)
+        if step % self.decimation == 0: # The decimated records also cover the recent window, they are not used there
+            self.older.push(step, store)
+
+    def extend(self, steps: np.ndarray, positions: np.ndarray, velocities: np.ndarray, accelerations: np.ndarray) -> None:
+        # Record several steps at once from arrays of shape (steps, bodies, 2), e.g. the ones returned by since. The
+        # steps that are not newer than the newest record are left out, the records stay in chronological order
+        steps = np.asarray(steps)
+        if len(self.recent):
+            newer = steps > self.recent.last(self.recent.steps)
+            steps, positions, velocities, accelerations = (steps[newer], positions[newer], velocities[newer],
+                                                           accelerations[newer])
+        self.recent.extend(steps, positions, velocities, accelerations)
+        decimated = steps % self.decimation == 0
+        self.older.extend(steps[decimated], positions[decimated], velocities[decimated], accelerations[decimated])
+
+    def since(self, step: int) -> Tuple[np.ndarray, ...]:
+        # Copies of the records at full resolution after the given step: the steps, and the positions, velocities and
+        # accelerations of shape (steps, bodies, 2). Only the ones still in the recent window
+        recent = self.recent
+        rows = (recent.written - len(recent) + np.arange(len(recent))) % recent.capacity # Chronological order
+        rows = rows[recent.steps[rows] > step]
+        return recent.steps[rows], recent.positions[rows], recent.velocities[rows], recent.accelerations[rows]
+
+    def clear(self) -> None:
+        self.recent.clear()
+        self.older.clear()
+
+    def recent_start(self) -> int:
+        # The step of the oldest record at full resolution
+        return int(self.recent.segments(self.recent.steps)[0][0])
+
+    def latest(self, field: str) -> np.ndarray:
+        # The newest record of "positions", "velocities" or "accelerations", shape (bodies, 2), a view
+        return self.recent.last(getattr(self.recent, field))
+
+    def segments(self, field: str) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        # All the history of a field in chronological order, as views: the decimated records before the recent window
+        # and then the recent ones. Returns the lists of the views of the steps and of the field
+        window_start = self.recent_start()
+        older_steps = self.older.segments(self.older.steps)
+        before = sum(int(np.searchsorted(segment, window_start)) for segment in older_steps)
+        return (self.older.segments(self.older.steps, before) + self.recent.segments(self.recent.steps),
+                self.older.segments(getattr(self.older, field), before) + self.recent.segments(getattr(self.recent, field)))
@@ -0,0 +1,220 @@
+import numpy as np
+
+from Kernels import drift, kick
+from ParticleStore import ParticleStore
+
+
+def update_accelerations(store: ParticleStore, solver) -> None:
+    store.ax, store.ay = solver.accelerations(store.x, store.y, store.mass)
+
+
+class EulerIntegrator(object):
+    # Semi-implicit (symplectic) Euler: the velocities are updated with the accelerations at the current positions,
+    # then the positions with the new velocities. First order, one force evaluation per step
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls()
+
+    def reset(self) -> None: # Called when the bodies or the solver change outside of the integrator
+        pass
+
+    def step(self, store: ParticleStore, solver, dt: float) -> None:
+        update_accelerations(store, solver)
+        kick(store.vx, store.vy, store.ax, store.ay, dt)
+        drift(store.x, store.y, store.vx, store.vy, dt)
+
+
+class LeapfrogIntegrator(object):
+    # Kick-drift-kick leapfrog: symplectic and second order. The accelerations at the end of a step are the ones at
+    # the beginning of the next, so after the first step it needs one force evaluation per step
+    def __init__(self) -> None:
+        self.ready = False # Whether the accelerations in the store belong to the current positions
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls()
+
+    def reset(self) -> None:
+        self.ready = False
+
+    def step(self, store: ParticleStore, solver, dt: float) -> None:
+        if not self.ready:
+            update_accelerations(store, solver)
+        kick(store.vx, store.vy, store.ax, store.ay, dt / 2)
+        drift(store.x, store.y, store.vx, store.vy, dt)
+        update_accelerations(store, solver)
+        kick(store.vx, store.vy, store.ax, store.ay, dt / 2)
+        self.ready = True
+
+
+class VelocityVerletIntegrator(object):
+    # Velocity Verlet: the positions are advanced with the velocities and the accelerations, and the velocities with
+    # the mean of the accelerations at both ends of the step. Equivalent to the leapfrog, in the textbook form
+    def __init__(self) -> None:
+        self.ready = False
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls()
+
+    def reset(self) -> None:
+        self.ready = False
+
+    def step(self, store: ParticleStore, solver, dt: float) -> None:
+        if not self.ready:
+            update_accelerations(store, solver)
+        store.x += store.vx * dt + store.ax * (dt * dt / 2)
+        store.y += store.vy * dt + store.ay * (dt * dt / 2)
+        old_ax, old_ay = store.ax, store.ay
+        update_accelerations(store, solver)
+        store.vx += (old_ax + store.ax) * (dt / 2)
+        store.vy += (old_ay + store.ay) * (dt / 2)
+        self.ready = True
+
+
+class RungeKutta4Integrator(object):
+    # Classic fourth order Runge-Kutta. Very accurate for short runs, but not symplectic, so the energy drifts over
+    # long runs. Four force evaluations per step. The store keeps the accelerations at the beginning of the step
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls()
+
+    def reset(self) -> None:
+        pass
+
+    def step(self, store: ParticleStore, solver, dt: float) -> None:
+        x, y, vx, vy = store.x.copy(), store.y.copy(), store.vx.copy(), store.vy.copy()
+        k1_ax, k1_ay = solver.accelerations(x, y, store.mass)
+        k2_ax, k2_ay = solver.accelerations(x + vx * (dt / 2), y + vy * (dt / 2), store.mass)
+        k2_vx, k2_vy = vx + k1_ax * (dt / 2), vy + k1_ay * (dt / 2)
+        k3_ax, k3_ay = solver.accelerations(x + k2_vx * (dt / 2), y + k2_vy * (dt / 2), store.mass)
+        k3_vx, k3_vy = vx + k2_ax * (dt / 2), vy + k2_ay * (dt / 2)
+        k4_ax, k4_ay = solver.accelerations(x + k3_vx * dt, y + k3_vy * dt, store.mass)
+        k4_vx, k4_vy = vx + k3_ax * dt, vy + k3_ay * dt
+
+        store.x += (vx + 2 * k2_vx + 2 * k3_vx + k4_vx) * (dt / 6)
+        store.y += (vy + 2 * k2_vy + 2 * k3_vy + k4_vy) * (dt / 6)
+        store.vx += (k1_ax + 2 * k2_ax + 2 * k3_ax + k4_ax) * (dt / 6)
+        store.vy += (k1_ay + 2 * k2_ay + 2 * k3_ay + k4_ay) * (dt / 6)
+        store.ax, store.ay = k1_ax, k1_ay
+
+
+class YoshidaIntegrator(object):
+    # Yoshida's fourth order symplectic integrator: three leapfrog steps of w1 * dt, w0 * dt and w1 * dt (the middle
+    # one goes backwards). Three force evaluations per step, as the leapfrog reuses the accelerations between them
+    W1 = 1 / (2 - 2 ** (1 / 3))
+    W0 = -(2 ** (1 / 3)) / (2 - 2 ** (1 / 3))
+
+    def __init__(self) -> None:
+        self.leapfrog = LeapfrogIntegrator()
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls()
+
+    def reset(self) -> None:
+        self.leapfrog.reset()
+
+    def step(self, store: ParticleStore, solver, dt: float) -> None:
+        for weight in (self.W1, self.W0, self.W1):
+            self.leapfrog.step(store, solver, weight * dt)
+
+
+class BlockTimestepIntegrator(object):
+    # Kick-drift-kick leapfrog with individual time steps on a power-of-two hierarchy: a body on level k makes steps
+    # of dt / 2^k, so bodies in tight orbits are updated often and the rest rarely. The level of a body follows its
+    # time scale |v| / |a|. All the bodies are drifted to every moment some of them need new accelerations, but only
+    # those are evaluated. Within one call every body ends up synchronized at the full dt
+    def __init__(self, max_level: int = 6, eta: float = 0.05) -> None:
+        self.max_level = max_level # Level 0 steps with dt, the finest level with dt / 2^max_level
+        self.eta = eta # The fraction of the time scale of a body that its step may take
+        self.ready = False
+        self.levels = np.zeros(0, dtype=np.int64) # The levels of the bodies during the last step, for statistics
+        self.evaluations = 0 # The number of accelerations of single bodies calculated so far
+        self.full_evaluations = 0 # How many of them a global step on the finest level would have needed
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls(max_level=int(config.get("block_max_level", 6)),
+                   eta=float(config.get("block_eta", 0.05)))
+
+    def reset(self) -> None:
+        self.ready = False
+
+    def wanted_levels(self, store: ParticleStore, bodies: np.ndarray, dt: float) -> np.ndarray:
+        speed = np.hypot(store.vx[bodies], store.vy[bodies])
+        acceleration = np.hypot(store.ax[bodies], store.ay[bodies])
+        time_scale = np.full(len(bodies), np.inf) # Bodies without acceleration can take the largest step
+        np.divide(speed, acceleration, out=time_scale, where=acceleration > 0)
+        with np.errstate(divide="ignore"):
+            levels = np.ceil(np.log2(dt / (self.eta * time_scale)))
+        return np.clip(np.nan_to_num(levels, nan=self.max_level, neginf=0), 0, self.max_level).astype(np.int64)
+
+    def evaluate(self, store: ParticleStore, solver, bodies: np.ndarray) -> None:
+        if len(bodies) == len(store) or not hasattr(solver, "accelerations_at"):
+            ax, ay = solver.accelerations(store.x, store.y, store.mass)
+            store.ax[bodies], store.ay[bodies] = ax[bodies], ay[bodies]
+        else: # Only the targets that need it
+            store.ax[bodies], store.ay[bodies] = solver.accelerations_at(store.x[bodies], store.y[bodies],
+                                                                         store.x, store.y, store.mass)
+        self.evaluations += len(bodies)
+
+    def step(self, store: ParticleStore, solver, dt: float) -> None:
+        everyone = np.arange(len(store))
+        if not self.ready:
+            store.ax, store.ay = np.zeros(len(store)), np.zeros(len(store))
+            self.evaluate(store, solver, everyone)
+            self.ready = True
+        ticks = 1 << self.max_level # The full step in the units of the finest step
+        tick = dt / ticks
+        self.full_evaluations += ticks * len(store)
+
+        levels = self.wanted_levels(store, everyone, dt)
+        step_ticks = ticks >> levels
+        store.vx += store.ax * (step_ticks * tick / 2) # Opening half kicks
+        store.vy += store.ay * (step_ticks * tick / 2)
+        step_end = step_ticks.copy()
+        self.levels = levels.copy()
+        time = 0
+        while time < ticks:
+            next_time = int(step_end.min())
+            drift(store.x, store.y, store.vx, store.vy, (next_time - time) * tick)
+            time = next_time
+            active = np.flatnonzero(step_end == time)
+            self.evaluate(store, solver, active)
+            store.vx[active] += store.ax[active] * (step_ticks[active] * tick / 2) # Closing half kicks
+            store.vy[active] += store.ay[active] * (step_ticks[active] * tick / 2)
+            if time == ticks:
+                break
+
+            # New steps of the active bodies. A body may always go to a finer level, but to a coarser one only if
+            # the current moment is on the grid of that level, so that the hierarchy stays aligned
+            wanted = self.wanted_levels(store, active, dt)
+            while True:
+                misaligned = time % (ticks >> wanted) != 0
+                if not misaligned.any():
+                    break
+                wanted[misaligned] += 1
+            levels[active] = wanted
+            self.levels[active] = np.maximum(self.levels[active], wanted)
+            step_ticks[active] = ticks >> wanted
+            store.vx[active] += store.ax[active] * (step_ticks[active] * tick / 2) # Opening half kicks
+            store.vy[active] += store.ay[active] * (step_ticks[active] * tick / 2)
+            step_end[active] = time + step_ticks[active]
+
+
+INTEGRATORS = {
+    "euler": EulerIntegrator,
+    "leapfrog": LeapfrogIntegrator,
+    "velocity_verlet": VelocityVerletIntegrator,
+    "rk4": RungeKutta4Integrator,
+    "yoshida4": YoshidaIntegrator,
+    "block": BlockTimestepIntegrator,
+}
+
+
+def make_integrator(config: dict): # Create the integrator selected in the SIMULATION section of the config
+    name = config.get("integrator", "euler")
+    if name not in INTEGRATORS:
+        raise ValueError(f"Unknown integrator: {name}. Available: {', '.join(INTEGRATORS)}")
+    return INTEGRATORS[name].from_config(config)
@@ -0,0 +1,139 @@
+import numpy as np
+
+try: # numba is optional, without it the same operations are done with NumPy
+    import numba
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+    # The kernels are also run from the physics and heatmap threads. Launched from a thread other than the main one,
+    # the default TBB layer keeps the interpreter from exiting, OpenMP does not
+    numba.config.THREADING_LAYER_PRIORITY = ["omp", "tbb", "workqueue"]
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+# The compiled kernels are cached on disk (cache=True), so the JIT compilation is only paid on the first launch
+# and after the kernels change. They are compiled lazily, on the first call, so importing this module is cheap
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, cache=True)
+    def compiled_accelerations(x, y, mass, ax, ay):
+        for i in prange(len(x)):
+            sum_x = 0.
+            sum_y = 0.
+            for j in range(len(x)):
+                dx = x[j] - x[i]
+                dy = y[j] - y[i]
+                distance_squared = dx * dx + dy * dy
+                if distance_squared > 0.: # The body does not attract itself
+                    strength = mass[j] / (distance_squared * np.sqrt(distance_squared))
+                    sum_x += dx * strength
+                    sum_y += dy * strength
+            ax[i] = sum_x
+            ay[i] = sum_y
+
+    @njit(cache=True) # Memory-bound, threads would not make it faster
+    def compiled_kick(vx, vy, ax, ay, dt):
+        for i in range(len(vx)):
+            vx[i] += ax[i] * dt
+            vy[i] += ay[i] * dt
+
+    @njit(cache=True)
+    def compiled_drift(x, y, vx, vy, dt):
+        for i in range(len(x)):
+            x[i] += vx[i] * dt
+            y[i] += vy[i] * dt
+
+    @njit(parallel=True, cache=True)
+    def compiled_force_field(pixel_x, pixel_y, x, y, mass, radius, field):
+        for i in prange(len(pixel_x)):
+            for j in range(len(pixel_y)):
+                sum_x = 0.
+                sum_y = 0.
+                for k in range(len(x)):
+                    dx = x[k] - pixel_x[i]
+                    dy = y[k] - pixel_y[j]
+                    distance = np.sqrt(dx * dx + dy * dy)
+                    if distance > 0.:
+                        strength = mass[k] / max(distance, radius[k]) ** 2 / distance
+                        sum_x += dx * strength
+                        sum_y += dy * strength
+                field[i, j] = np.sqrt(sum_x * sum_x + sum_y * sum_y)
+
+    @njit(parallel=True, cache=True)
+    def compiled_potential_field(pixel_x, pixel_y, x, y, mass, radius, field):
+        for i in prange(len(pixel_x)):
+            for j in range(len(pixel_y)):
+                total = 0.
+                for k in range(len(x)):
+                    dx = x[k] - pixel_x[i]
+                    dy = y[k] - pixel_y[j]
+                    distance = np.sqrt(dx * dx + dy * dy)
+                    if distance > 0.:
+                        total -= mass[k] / max(distance, radius[k])
+                field[i, j] = total
+
+
+def kick(vx: np.ndarray, vy: np.ndarray, ax: np.ndarray, ay: np.ndarray, dt: float) -> None:
+    # Update the velocities in place
+    if NUMBA_AVAILABLE:
+        compiled_kick(vx, vy, ax, ay, dt)
+    else:
+        vx += ax * dt
+        vy += ay * dt
+
+
+def drift(x: np.ndarray, y: np.ndarray, vx: np.ndarray, vy: np.ndarray, dt: float) -> None:
+    # Update the positions in place
+    if NUMBA_AVAILABLE:
+        compiled_drift(x, y, vx, vy, dt)
+    else:
+        x += vx * dt
+        y += vy * dt
+
+
+def force_field(pixel_x: np.ndarray,
+                pixel_y: np.ndarray,
+                x: np.ndarray,
+                y: np.ndarray,
+                mass: np.ndarray,
+                radius: np.ndarray,
+                memory_budget: int = 16 * 1024 * 1024) -> np.ndarray:
+    # The magnitude of the field at every point of the grid pixel_x x pixel_y, shape (len(pixel_x), len(pixel_y)).
+    # Closer than its radius a body attracts as if the point was on its surface
+    field = np.empty((len(pixel_x), len(pixel_y)))
+    if NUMBA_AVAILABLE:
+        compiled_force_field(pixel_x, pixel_y, x, y, mass, radius, field)
+        return field
+    # All the bodies at once for a chunk of rows of the grid, as large as the memory budget allows for the
+    # (rows, len(pixel_y), bodies) temporaries
+    rows = max(1, memory_budget // (4 * 8 * max(len(pixel_y), 1) * max(len(x), 1)))
+    dy = y - pixel_y[:, np.newaxis] # (len(pixel_y), bodies), the same for every row
+    for first in range(0, len(pixel_x), rows):
+        dx = (x - pixel_x[first:first + rows, np.newaxis])[:, np.newaxis, :] # (rows, 1, bodies)
+        distance = np.hypot(dx, dy)
+        strength = np.zeros(distance.shape)
+        np.divide(mass, np.maximum(distance, radius) ** 2 * distance, out=strength, where=distance > 0)
+        np.hypot((dx * strength).sum(axis=2), (dy * strength).sum(axis=2), out=field[first:first + rows])
+    return field
+
+
+def potential_field(pixel_x: np.ndarray,
+                    pixel_y: np.ndarray,
+                    x: np.ndarray,
+                    y: np.ndarray,
+                    mass: np.ndarray,
+                    radius: np.ndarray,
+                    memory_budget: int = 16 * 1024 * 1024) -> np.ndarray:
+    # The potential -m / r at every point of the grid pixel_x x pixel_y, like force_field
+    field = np.empty((len(pixel_x), len(pixel_y)))
+    if NUMBA_AVAILABLE:
+        compiled_potential_field(pixel_x, pixel_y, x, y, mass, radius, field)
+        return field
+    rows = max(1, memory_budget // (3 * 8 * max(len(pixel_y), 1) * max(len(x), 1)))
+    dy = y - pixel_y[:, np.newaxis]
+    for first in range(0, len(pixel_x), rows):
+        dx = (x - pixel_x[first:first + rows, np.newaxis])[:, np.newaxis, :]
+        distance = np.hypot(dx, dy)
+        potential = np.zeros(distance.shape)
+        np.divide(-mass, np.maximum(distance, radius), out=potential, where=distance > 0)
+        potential.sum(axis=2, out=field[first:first + rows])
+    return field
@@ -1,13 +1,16 @@
 import sys
-import time
-from threading import Thread, Condition
+from multiprocessing import freeze_support
+from threading import Thread
 from typing import List
 
 import PySide6.QtCore as QtCore
-from PySide6.QtGui import QPixmap
-from PySide6.QtWidgets import QApplication, QMainWindow, QFileDialog
+from PySide6.QtWidgets import QApplication, QMainWindow, QFileDialog, QMessageBox
 
+from Frames import Frame
+from Heatmap import HeatmapCache, HeatmapJob, HeatmapPool
 from MainwindowUi import MainwindowUi
+from Pipeline import ProcessPipeline, SimulationPipeline
+from Replay import Replay
 from SaveLoad import *
 from Simulation import Simulation
 
@@ -19,23 +22,27 @@ class ListItem(object): # Helps to associate captions in the lstBodies to the Pa
 
 
 class MainWindow(QMainWindow):
+    heatmap_ready = QtCore.Signal(object, object) # (job, frame) from the heatmap thread, shown in the GUI thread
+
     def __init__(self):
         super(MainWindow, self).__init__() # Load the interface from MainwindowUi file
-        self.simulation_cycle_thread = None
-        self.draw_cycle_thread = None
         self.simulation_instance = None
+        self.pipeline = None # Runs the simulation and draws its frames while it is started
+        self.replay = None # The trajectory file shown with the timeline, if one is open
+        self.heatmap_job = None # The heatmap being computed, if any
         self.ui = MainwindowUi()
         self.ui.setupUi(self)
         self.current_min_free_id: int = 1 # Minimal unoccupied particle id
         self.particle_list: List[ListItem] = []
-        self.draw_condition = Condition()
-
 
         self.simulation_running = False
         with open("config.json") as f: # Load the config file
             self.config = load(f)
 
         self.frame_delay: float = 1 / self.config["SIMULATION"]["fps_limit"] # Set the minimal delay between frames
+        self.steps_per_frame: int = int(self.config["SIMULATION"].get("steps_per_frame", 1)) # Physics steps per displayed frame
+        self.heatmap_pool = HeatmapPool.from_config(self.config["DRAWING"]) # Worker processes for the heatmap tiles
+        self.heatmap_cache = HeatmapCache.from_config(self.config["DRAWING"]) # The heatmaps shown before
 
         # Connect the functions to the corresponding buttons
         self.ui.btnAdd.clicked.connect(self.add_particle)
@@ -47,6 +54,15 @@ class MainWindow(QMainWindow):
         self.ui.btnSave.clicked.connect(self.save_state_to_file)
         self.ui.btnLoad.clicked.connect(self.load_state_from_file)
         self.ui.btnEdit.clicked.connect(self.edit_particle)
+        self.ui.btnReplay.clicked.connect(self.open_replay)
+        self.ui.sldTimeline.valueChanged.connect(self.show_replay_frame)
+        for checkbox in (self.ui.cbxDrawTrails, self.ui.cbxDrawSpdVects, self.ui.cbxDrawMassCenter, self.ui.cbxColorDependent):
+            checkbox.toggled.connect(self.refresh_replay_frame) # Show the replayed frame with the new options
+        self.ui.cbbColorDependsOn.currentIndexChanged.connect(self.refresh_replay_frame)
+        self.heatmap_ready.connect(self.show_heatmap_frame)
+        self.frame_timer = QtCore.QTimer(self) # Shows the newest frame of the pipeline, at most fps_limit times a second
+        self.frame_timer.setInterval(int(self.frame_delay * 1000))
+        self.frame_timer.timeout.connect(self.show_next_frame)
 
         # Disable the buttons to prevent exceptions
         self.ui.btnShowHeatMap.setDisabled(True)
@@ -55,6 +71,8 @@ class MainWindow(QMainWindow):
 
     def closeEvent(self, *args, **kwargs): # Ensure that additional threads are stopped whe the app is exited
         super(QMainWindow, self).closeEvent(*args, **kwargs)
+        self.cancel_heatmap()
+        self.heatmap_pool.close()
         if self.simulation_running:
             self.stop_simulation()
 
@@ -62,6 +80,10 @@ class MainWindow(QMainWindow):
         self.ui.lstBodies.clear()
         self.ui.lstBodies.addItems([x.label for x in self.particle_list])
 
+    def sync_particle_list(self): # Take the current state of the bodies from the simulation, so it can be resumed
+        self.particle_list = [ListItem(x) for x in self.simulation_instance.particles]
+        self.update_list_view()
+
     def add_particle(self):
         temp = Particle(id=self.current_min_free_id,
                         position=Vector2D(self.ui.spbPosX.value(), self.ui.spbPosY.value()),
@@ -113,35 +135,44 @@ class MainWindow(QMainWindow):
                                                   dir="./saves/")
         save_initial_state([x.particle for x in self.particle_list], filename)
     def start_simulation(self):
-        self.simulation_instance = Simulation(particles=[x.particle for x in self.particle_list],
-                                              framesize=(int(self.config["SIMULATION"]["frame_size_x"]),
-                                                         int(self.config["SIMULATION"]["frame_size_y"]))) # Create a new simulation instance
+        self.cancel_heatmap() # The heatmap is of the previous simulation
+        particles = [x.particle for x in self.particle_list]
+        framesize = (int(self.config["SIMULATION"]["frame_size_x"]), int(self.config["SIMULATION"]["frame_size_y"]))
+        if self.config["SIMULATION"].get("physics_process", False): # The physics runs in a child process
+            # The child records the trajectory. This one can still make single steps after the pipeline has stopped
+            self.simulation_instance = Simulation.for_drawing(particles, framesize, self.config, physics=True)
+            self.pipeline = ProcessPipeline.from_config(self.simulation_instance, self.config)
+        else:
+            self.simulation_instance = Simulation(particles=particles, framesize=framesize) # Create a new simulation instance
+            self.pipeline = SimulationPipeline(self.simulation_instance, self.steps_per_frame)
+        self.close_replay()
         self.simulation_running = True
-        self.draw_cycle_thread = Thread(target=self.draw_cycle)
-        self.simulation_cycle_thread = Thread(target=self.simulation_cycle)
-        self.simulation_cycle_thread.start() # Start additional threads
-        self.draw_cycle_thread.start()
+        self.pipeline.options = self.drawing_options()
+        self.ui.lblSimulationDisplay.profiler = self.pipeline.profiler # The painting is timed with the other stages
+        self.pipeline.start() # Start additional threads
+        self.frame_timer.start()
         self.ui.btnShowHeatMap.setDisabled(True) # Disable buttons to prevent exceptions
         self.ui.btnSimStart.setDisabled(True)
         self.ui.btnSimStep.setDisabled(True)
         self.ui.gpbEdit.setDisabled(True)
         self.ui.btnSimStop.setEnabled(True) # Enable the buttons that stops the simulation
+        self.ui.btnReplay.setDisabled(True)
 
     def stop_simulation(self):
         self.simulation_running = False
-        self.simulation_cycle_thread.join() # Join the threads
-        self.draw_cycle_thread.join()
+        self.frame_timer.stop()
+        self.pipeline.stop() # Join the threads
+        if self.pipeline.profiler.enabled: # DRAWING.profile_frames: where the time of the frames went
+            print(self.pipeline.profiler.report())
+        self.pipeline = None
+        self.simulation_instance.close() # Finish the trajectory file
+        self.sync_particle_list()
         self.ui.btnShowHeatMap.setEnabled(True) # Enable buttons
         self.ui.btnSimStart.setEnabled(True)
         self.ui.btnSimStep.setEnabled(True)
         self.ui.gpbEdit.setEnabled(True)
         self.ui.btnSimStop.setDisabled(True)
-
-    def draw_cycle(self):
-        while self.simulation_running:
-            with self.draw_condition:
-                self.draw_condition.notify() # Allow the new step to be rendered
-                time.sleep(self.frame_delay) # Wait the minimal delay
+        self.ui.btnReplay.setEnabled(True)
 
     def get_dependent_coloring_type(self) -> str: # Convert the selected text to pre-defined values
         match self.ui.cbbColorDependsOn.currentText():
@@ -150,45 +181,87 @@ class MainWindow(QMainWindow):
             case "ускорения":
                 return "acceleration"
 
-    def simulation_cycle(self):
-        while self.simulation_running:
-            with self.draw_condition:
-                self.draw_condition.wait(1.0) # Wait until the permission from draw_cycle, but no more than 1 second
-                self.ui.lblSimulationDisplay.setPixmap(QPixmap.fromImage(
-                    self.simulation_instance.run_step( # Generate the new frame
-                        draw_barycenter=self.ui.cbxDrawMassCenter.isChecked(),
-                        draw_velocity_vectors=self.ui.cbxDrawSpdVects.isChecked(),
-                        draw_trails=self.ui.cbxDrawTrails.isChecked(),
-                        dependent_coloring=self.ui.cbxColorDependent.isChecked(),
-                        dependent_coloring_type=self.get_dependent_coloring_type())).scaled(
-                    self.ui.lblSimulationDisplay.width(),
-                    self.ui.lblSimulationDisplay.height(),
-                    QtCore.Qt.KeepAspectRatio # Resize it so it fits the size of lblSimulationDisplay
-                ))
-
-    def draw_heatmap(self): # Generate the force heatmap
-        self.ui.lblSimulationDisplay.setPixmap(QPixmap.fromImage(
-            self.simulation_instance.draw_force_heatmap().scaled(
-                self.ui.lblSimulationDisplay.width(),
-                self.ui.lblSimulationDisplay.height(),
-                QtCore.Qt.KeepAspectRatio
-            )))
+    def drawing_options(self) -> dict: # The keyword arguments of Simulation.render from the checkboxes
+        return dict(draw_barycenter=self.ui.cbxDrawMassCenter.isChecked(),
+                    draw_velocity_vectors=self.ui.cbxDrawSpdVects.isChecked(),
+                    draw_trails=self.ui.cbxDrawTrails.isChecked(),
+                    dependent_coloring=self.ui.cbxColorDependent.isChecked(),
+                    dependent_coloring_type=self.get_dependent_coloring_type(),
+                    labelled_ids=[self.particle_list[index.row()].particle.id # The ids of the selected bodies are always drawn
+                                  for index in self.ui.lstBodies.selectedIndexes()])
+
+    def show_next_frame(self): # Called by frame_timer in the GUI thread, shows the newest frame drawn by the pipeline
+        self.pipeline.options = self.drawing_options() # Used from the next drawn frame
+        frame = self.pipeline.take_frame()
+        if frame is None: # No new frame since the last time
+            return
+        self.ui.lblSimulationDisplay.show_frame(frame) # Scaled to fit lblSimulationDisplay when it is painted
+
+    def draw_heatmap(self): # Generate the force heatmap in the background, showing its tiles as they are done
+        self.cancel_heatmap()
+        job = HeatmapJob(self.simulation_instance, self.heatmap_pool, self.heatmap_cache)
+        self.heatmap_job = job
+        Thread(target=job.run, args=(lambda frame: self.heatmap_ready.emit(job, frame),), daemon=True).start()
+
+    def cancel_heatmap(self):
+        if self.heatmap_job is not None:
+            self.heatmap_job.cancel()
+            self.heatmap_job = None
+
+    def show_heatmap_frame(self, job: HeatmapJob, frame):
+        if job is not self.heatmap_job: # Already emitted when the job was cancelled
+            return
+        self.ui.lblSimulationDisplay.show_frame(Frame.from_rgb(frame))
 
     def run_single_step(self): # Generates the next frame of current simulation
-        self.ui.lblSimulationDisplay.setPixmap(QPixmap.fromImage(
-            self.simulation_instance.run_step(
-                draw_barycenter=self.ui.cbxDrawMassCenter.isChecked(),
-                draw_velocity_vectors=self.ui.cbxDrawSpdVects.isChecked(),
-                draw_trails=self.ui.cbxDrawTrails.isChecked(),
-                dependent_coloring=self.ui.cbxColorDependent.isChecked(),
-                dependent_coloring_type=self.get_dependent_coloring_type())).scaled(
-            self.ui.lblSimulationDisplay.width(),
-            self.ui.lblSimulationDisplay.height(),
-            QtCore.Qt.KeepAspectRatio
-        ))
+        self.cancel_heatmap()
+        self.ui.lblSimulationDisplay.show_frame(self.simulation_instance.run_step(**self.drawing_options()))
+        self.sync_particle_list()
+
+    def open_replay(self): # Show a recorded trajectory file, frame by frame with the timeline
+        filename, _ = QFileDialog.getOpenFileName(self,
+                                                  caption="Открыть запись траекторий",
+                                                  filter="Trajectory files (*.npy)",
+                                                  dir="./")
+        if not filename:
+            return
+        try:
+            replay = Replay(filename, framesize=(int(self.config["SIMULATION"]["frame_size_x"]),
+                                                 int(self.config["SIMULATION"]["frame_size_y"])))
+        except (OSError, ValueError) as error: # Not a trajectory file, or its bodies file is missing or does not match
+            QMessageBox.warning(self, "Открыть запись траекторий", f"Не удалось открыть запись траекторий:\n{error}")
+            return
+        if len(replay) == 0:
+            return
+        self.cancel_heatmap()
+        self.replay = replay
+        self.ui.btnShowHeatMap.setDisabled(True) # The heatmap and the steps belong to the simulation, not the replay
+        self.ui.btnSimStep.setDisabled(True)
+        self.ui.sldTimeline.setRange(0, len(replay) - 1)
+        self.ui.sldTimeline.setEnabled(True)
+        if self.ui.sldTimeline.value() == 0:
+            self.show_replay_frame(0)
+        else:
+            self.ui.sldTimeline.setValue(0)
+
+    def close_replay(self):
+        self.replay = None
+        self.ui.sldTimeline.setDisabled(True)
+        self.ui.lblTimeline.setText("")
+
+    def refresh_replay_frame(self):
+        if self.replay is not None:
+            self.show_replay_frame(self.ui.sldTimeline.value())
+
+    def show_replay_frame(self, index: int): # Draw only the record the timeline points at
+        if self.replay is None:
+            return
+        self.ui.lblSimulationDisplay.show_frame(self.replay.render(index, **self.drawing_options()))
+        self.ui.lblTimeline.setText(f"{self.replay.step(index)}")
 
 
 if __name__ == "__main__":
+    freeze_support() # The parallel physics backend starts worker processes, which needs this in a frozen executable
     app = QApplication(sys.argv)
 
     window = MainWindow()
@@ -18,8 +18,10 @@ from PySide6.QtGui import (QBrush, QColor, QConicalGradient, QCursor,
 from PySide6.QtWidgets import (QApplication, QCheckBox, QComboBox, QFrame,
     QGridLayout, QGroupBox, QHBoxLayout, QLabel,
     QLayout, QListWidget, QListWidgetItem, QMainWindow,
-    QPushButton, QSizePolicy, QSpinBox, QVBoxLayout,
-    QWidget)
+    QPushButton, QSizePolicy, QSlider, QSpinBox,
+    QVBoxLayout, QWidget)
+
+from FrameView import FrameView
 import resource_rc
 
 class MainwindowUi(object):
@@ -360,6 +362,16 @@ class MainwindowUi(object):
 
         self.horizontalLayout_2.addWidget(self.btnShowHeatMap)
 
+        self.btnReplay = QPushButton(self.verticalLayoutWidget_3)
+        self.btnReplay.setObjectName(u"btnReplay")
+        sizePolicy5.setHeightForWidth(self.btnReplay.sizePolicy().hasHeightForWidth())
+        self.btnReplay.setSizePolicy(sizePolicy5)
+        self.btnReplay.setMinimumSize(QSize(23, 23))
+        self.btnReplay.setMaximumSize(QSize(23, 23))
+        self.btnReplay.setIcon(icon4)
+
+        self.horizontalLayout_2.addWidget(self.btnReplay)
+
 
         self.vloSimSettings.addLayout(self.horizontalLayout_2)
 
@@ -376,7 +388,10 @@ class MainwindowUi(object):
 
         self.horizontalLayout.addLayout(self.vloToolbar)
 
-        self.lblSimulationDisplay = QLabel(self.horizontalLayoutWidget)
+        self.vloDisplay = QVBoxLayout()
+        self.vloDisplay.setSpacing(0)
+        self.vloDisplay.setObjectName(u"vloDisplay")
+        self.lblSimulationDisplay = FrameView(self.horizontalLayoutWidget)
         self.lblSimulationDisplay.setObjectName(u"lblSimulationDisplay")
         sizePolicy.setHeightForWidth(self.lblSimulationDisplay.sizePolicy().hasHeightForWidth())
         self.lblSimulationDisplay.setSizePolicy(sizePolicy)
@@ -384,7 +399,29 @@ class MainwindowUi(object):
         self.lblSimulationDisplay.setFrameShape(QFrame.Panel)
         self.lblSimulationDisplay.setFrameShadow(QFrame.Raised)
 
-        self.horizontalLayout.addWidget(self.lblSimulationDisplay)
+        self.vloDisplay.addWidget(self.lblSimulationDisplay)
+
+        self.hloTimeline = QHBoxLayout()
+        self.hloTimeline.setObjectName(u"hloTimeline")
+        self.sldTimeline = QSlider(self.horizontalLayoutWidget)
+        self.sldTimeline.setObjectName(u"sldTimeline")
+        self.sldTimeline.setEnabled(False)
+        self.sldTimeline.setOrientation(Qt.Horizontal)
+
+        self.hloTimeline.addWidget(self.sldTimeline)
+
+        self.lblTimeline = QLabel(self.horizontalLayoutWidget)
+        self.lblTimeline.setObjectName(u"lblTimeline")
+        self.lblTimeline.setMinimumSize(QSize(80, 0))
+        self.lblTimeline.setAlignment(Qt.AlignRight|Qt.AlignTrailing|Qt.AlignVCenter)
+
+        self.hloTimeline.addWidget(self.lblTimeline)
+
+
+        self.vloDisplay.addLayout(self.hloTimeline)
+
+
+        self.horizontalLayout.addLayout(self.vloDisplay)
 
         MainwindowUi.setCentralWidget(self.centralwidget)
 
@@ -438,7 +475,11 @@ class MainwindowUi(object):
         self.btnSimStep.setText("")
         self.btnSimStop.setText("")
         self.btnShowHeatMap.setText("")
+#if QT_CONFIG(tooltip)
+        self.btnReplay.setToolTip(QCoreApplication.translate("MainwindowUi", u"\u041e\u0442\u043a\u0440\u044b\u0442\u044c \u0437\u0430\u043f\u0438\u0441\u044c \u0442\u0440\u0430\u0435\u043a\u0442\u043e\u0440\u0438\u0439", None))
+#endif // QT_CONFIG(tooltip)
+        self.btnReplay.setText("")
         self.lblCreator.setText(QCoreApplication.translate("MainwindowUi", u"by Egor Kosachev | Distributed via MIT Liscence", None))
-        self.lblSimulationDisplay.setText("")
+        self.lblTimeline.setText("")
     # retranslateUi
 
@@ -0,0 +1,251 @@
+from typing import Tuple
+
+import numpy as np
+
+from BarnesHut import accumulate, ragged_arange
+
+
+# The force law of the simulation, m * r / |r|^3, is not harmonic in the plane, so the classic complex-number
+# expansions of the logarithmic potential do not apply to it. Instead the expansions are Chebyshev interpolants
+# (the "black-box" FMM): every cell carries equivalent masses at p x p Chebyshev nodes (multipole) and the
+# field sampled at the same nodes (local), and p is the expansion order
+
+
+def chebyshev_nodes(order: int) -> np.ndarray:
+    return np.cos((2 * np.arange(order) + 1) * np.pi / (2 * order))
+
+
+def interpolation_weights(order: int, points: np.ndarray) -> np.ndarray:
+    # S(node_a, point) for every point and node: the weight of the value at node_a in the interpolant at the point.
+    # Points are in the [-1, 1] coordinates of the cell, the result has shape (len(points), order)
+    nodes = chebyshev_nodes(order)
+    k = np.arange(1, order)
+    node_terms = np.cos(np.outer(np.arccos(nodes), k))
+    point_terms = np.cos(np.outer(np.arccos(np.clip(points, -1., 1.)), k))
+    return 1 / order + 2 / order * point_terms @ node_terms.T
+
+
+class MultipoleSolver(object):
+    # Approximate O(N) solver on a uniform quadtree, the depth of which is chosen for every step
+    def __init__(self, order: int = 5) -> None:
+        self.order = order
+        nodes = chebyshev_nodes(order)
+
+        # M2M and L2L: the nodes of the lower (0) and upper (1) child in the coordinates of the parent cell
+        self.transfer = np.stack([interpolation_weights(order, nodes / 2 + shift).T for shift in (-0.5, 0.5)])
+
+        # M2L: the field at the nodes of a cell of size 1 created by unit masses at the nodes of a cell shifted by
+        # (ox, oy). Only the shifts between children of neighbouring parents that are not neighbours are needed
+        node_x = np.repeat(nodes, order) / 2 # Node (a, b) has index a * order + b
+        node_y = np.tile(nodes, order) / 2
+        self.interactions = {}
+        for parity_x in range(2):
+            for parity_y in range(2):
+                shifts = []
+                for ox in range(-3, 4):
+                    for oy in range(-3, 4):
+                        if max(abs(ox), abs(oy)) < 2: # Neighbours are summed directly
+                            continue
+                        if abs((parity_x + ox) // 2) > 1 or abs((parity_y + oy) // 2) > 1: # Handled by the parents
+                            continue
+                        shifts.append((ox, oy))
+                self.interactions[(parity_x, parity_y)] = shifts
+        # The kernels of all the shifts of a parity class are stacked, so that M2L is one matrix product per class.
+        # The field has two components, with the potential there are three
+        self.kernels = {}
+        self.potential_kernels = {}
+        for parity, shifts in self.interactions.items():
+            kernels = []
+            for ox, oy in shifts:
+                dx = ox + node_x[:, np.newaxis] - node_x[np.newaxis, :] # [source node, target node]
+                dy = oy + node_y[:, np.newaxis] - node_y[np.newaxis, :]
+                distance = np.sqrt(dx * dx + dy * dy)
+                kernels.append(np.stack((dx / distance ** 3, dy / distance ** 3, -1 / distance), axis=-1))
+            kernels = np.concatenate(kernels) # [shift and source node, target node, component]
+            self.kernels[parity] = np.ascontiguousarray(kernels[..., :2]).reshape(len(kernels), -1)
+            self.potential_kernels[parity] = kernels.reshape(len(kernels), -1)
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls(order=int(config.get("fmm_order", 5)))
+
+    def depth(self,
+              x: np.ndarray,
+              y: np.ndarray,
+              tx: np.ndarray,
+              ty: np.ndarray,
+              left: float,
+              top: float,
+              width: float) -> int:
+        # Pick the depth with the lowest estimated cost. Deeper trees have fewer target-body pairs in the neighbouring
+        # leaves, but more cells to translate the expansions of. The costs were measured on a single core, in nanoseconds
+        best_depth, best_cost = 2, float("inf")
+        depth = 2 # The first level with well separated cells
+        while depth == 2 or 4 ** depth <= 16 * max(len(x), len(tx)): # Every level is stored as a full grid, so it is limited
+            cells = 1 << depth
+            occupancy = np.zeros((cells + 2, cells + 2))
+            occupancy[1:-1, 1:-1] = self.cell_counts(x, y, left, top, width, cells)
+            neighbours = sum(occupancy[1 + ox:cells + 1 + ox, 1 + oy:cells + 1 + oy]
+                             for ox in (-1, 0, 1) for oy in (-1, 0, 1))
+            pairs = float((self.cell_counts(tx, ty, left, top, width, cells) * neighbours).sum())
+            all_cells = (4 ** (depth + 1) - 1) / 3
+            cost = pairs * 70 + all_cells * (3000 + 10 * self.order ** 4)
+            if cost >= best_cost: # The cost only grows from here
+                break
+            best_depth, best_cost = depth, cost
+            depth += 1
+        return best_depth
+
+    @staticmethod
+    def cell_counts(x: np.ndarray, y: np.ndarray, left: float, top: float, width: float, cells: int) -> np.ndarray:
+        ix = np.minimum(((x - left) / width * cells).astype(np.int64), cells - 1)
+        iy = np.minimum(((y - top) / width * cells).astype(np.int64), cells - 1)
+        return np.bincount(ix * cells + iy, minlength=cells * cells).reshape(cells, cells)
+
+    def accelerations(self, x: np.ndarray, y: np.ndarray, mass: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        field = self.field_at(x, y, x, y, mass)
+        return field[:, 0], field[:, 1]
+
+    def field_at(self,
+                 tx: np.ndarray,
+                 ty: np.ndarray,
+                 x: np.ndarray,
+                 y: np.ndarray,
+                 mass: np.ndarray,
+                 radius: np.ndarray = None,
+                 potential: bool = False) -> np.ndarray:
+        # The field of the bodies at the target points, shape (targets, 2), or (targets, 3) with the potential as the
+        # last component. With radii, the bodies summed directly act on the points inside them as if the points were
+        # on their surface, like in the heatmap. The bodies in well separated cells are always treated as points
+        channels = 3 if potential else 2
+        count = len(x)
+        if count == 0 or len(tx) == 0:
+            return np.zeros((len(tx), channels))
+        order = self.order
+        left, top = min(float(x.min()), float(tx.min())), min(float(y.min()), float(ty.min()))
+        width = max(max(float(x.max()), float(tx.max())) - left, max(float(y.max()), float(ty.max())) - top, 1e-12)
+        width *= 1 + 1e-9
+        depth = self.depth(x, y, tx, ty, left, top, width)
+        cells = 1 << depth
+
+        # Put the bodies and the targets into the leaf cells and sort them by cell
+        cell_width = width / cells
+        ix = np.minimum(((x - left) / cell_width).astype(np.int64), cells - 1)
+        iy = np.minimum(((y - top) / cell_width).astype(np.int64), cells - 1)
+        cell = ix * cells + iy
+        order_of_bodies = np.argsort(cell, kind="stable")
+        cell = cell[order_of_bodies]
+        sx, sy, sm = x[order_of_bodies], y[order_of_bodies], mass[order_of_bodies]
+        sr = radius[order_of_bodies] if radius is not None else None
+        cell_start = np.searchsorted(cell, np.arange(cells * cells))
+        cell_count = np.diff(np.append(cell_start, count))
+        u = 2 * ((sx - left) / cell_width - ix[order_of_bodies]) - 1 # Coordinates inside the cell, in [-1, 1]
+        v = 2 * ((sy - top) / cell_width - iy[order_of_bodies]) - 1
+
+        target_ix = np.minimum(((tx - left) / cell_width).astype(np.int64), cells - 1)
+        target_iy = np.minimum(((ty - top) / cell_width).astype(np.int64), cells - 1)
+        target_cell = target_ix * cells + target_iy
+        order_of_targets = np.argsort(target_cell, kind="stable") # Neighbouring targets use the same cells
+        target_cell = target_cell[order_of_targets]
+        stx, sty = tx[order_of_targets], ty[order_of_targets]
+        target_u = 2 * ((stx - left) / cell_width - target_ix[order_of_targets]) - 1
+        target_v = 2 * ((sty - top) / cell_width - target_iy[order_of_targets]) - 1
+
+        # P2M: anterpolate the masses of the bodies onto the nodes of their leaf
+        multipoles = [None] * (depth + 1)
+        leaf = np.zeros((cells * cells, order, order))
+        for first in range(0, count, 65536):
+            part = slice(first, first + 65536)
+            weights = (sm[part, np.newaxis, np.newaxis] *
+                       interpolation_weights(order, u[part])[:, :, np.newaxis] *
+                       interpolation_weights(order, v[part])[:, np.newaxis, :])
+            segments = np.flatnonzero(np.diff(cell[part], prepend=-1))
+            leaf[cell[part][segments]] += np.add.reduceat(weights, segments, axis=0)
+        multipoles[depth] = leaf.reshape(cells, cells, order, order)
+
+        # M2M: pass the multipoles up to the level 2, the first one with well separated cells
+        for level in range(depth, 2, -1):
+            n = 1 << (level - 1)
+            children = multipoles[level].reshape(n, 2, n, 2, order, order)
+            multipoles[level - 1] = np.einsum("xac,ybd,ixjycd->ijab", self.transfer, self.transfer, children, optimize=True)
+
+        # M2L and L2L: collect the field of well separated cells and pass it down to the leaves
+        kernels = self.potential_kernels if potential else self.kernels
+        local = None
+        for level in range(2, depth + 1):
+            n = 1 << level
+            cell_size = width / n
+            scale = np.array([1 / cell_size ** 2] * 2 + [1 / cell_size] * (channels - 2)) # The potential is 1 / r
+            if local is None:
+                local = np.zeros((n, n, order * order, channels))
+            else:
+                parents = local.reshape(n // 2, n // 2, order, order, channels)
+                local = np.einsum("xac,ybd,ijabk->ixjycdk", self.transfer, self.transfer, parents, optimize=True)
+                local = local.reshape(n, n, order * order, channels)
+            padded = np.zeros((n + 6, n + 6, order * order))
+            padded[3:n + 3, 3:n + 3] = multipoles[level].reshape(n, n, order * order)
+            for (parity_x, parity_y), shifts in self.interactions.items():
+                target = local[parity_x::2, parity_y::2]
+                sources = np.concatenate([padded[parity_x + ox + 3:n + ox + 3:2, parity_y + oy + 3:n + oy + 3:2]
+                                          for ox, oy in shifts], axis=-1)
+                field = sources.reshape(-1, sources.shape[-1]) @ kernels[(parity_x, parity_y)]
+                target += field.reshape(target.shape) * scale
+
+        result = np.zeros((len(tx), channels))
+
+        # L2P: interpolate the field of the leaf to the targets
+        if local is not None:
+            local = local.reshape(cells * cells, order, order, channels)
+            for first in range(0, len(tx), 65536):
+                part = slice(first, first + 65536)
+                result[part] += np.einsum("na,nb,nabk->nk",
+                                          interpolation_weights(order, target_u[part]),
+                                          interpolation_weights(order, target_v[part]),
+                                          local[target_cell[part]], optimize=True)
+
+        # P2P: sum the bodies of the neighbouring leaves directly
+        target_x, target_y = target_cell // cells, target_cell % cells
+        for first in range(0, len(tx), 4096):
+            targets = np.arange(first, min(first + 4096, len(tx)))
+            for ox in (-1, 0, 1):
+                for oy in (-1, 0, 1):
+                    nx, ny = target_x[targets] + ox, target_y[targets] + oy
+                    inside = (nx >= 0) & (nx < cells) & (ny >= 0) & (ny < cells)
+                    neighbours = nx[inside] * cells + ny[inside]
+                    counts = cell_count[neighbours]
+                    sources = ragged_arange(cell_start[neighbours], counts)
+                    pair_targets = np.repeat(targets[inside], counts)
+                    dx = sx[sources] - stx[pair_targets]
+                    dy = sy[sources] - sty[pair_targets]
+                    if radius is None and not potential:
+                        accumulate(result[first:first + 4096, 0], result[first:first + 4096, 1], pair_targets - first,
+                                   dx, dy, dx * dx + dy * dy, sm[sources])
+                    else:
+                        accumulate_field(result[first:first + 4096], pair_targets - first, dx, dy, sm[sources],
+                                         sr[sources] if sr is not None else None)
+
+        unsorted = np.empty_like(result)
+        unsorted[order_of_targets] = result
+        return unsorted
+
+
+def accumulate_field(result: np.ndarray,
+                     targets: np.ndarray,
+                     dx: np.ndarray,
+                     dy: np.ndarray,
+                     mass: np.ndarray,
+                     radius: np.ndarray = None) -> None:
+    # Add the field of bodies at (dx, dy) relative to the targets, and their potential if result has 3 columns.
+    # Closer than its radius a body acts as if the target was on its surface. Zero distances are masked out
+    if len(targets) == 0:
+        return
+    distance = np.sqrt(dx * dx + dy * dy)
+    reach = distance if radius is None else np.maximum(distance, radius)
+    strength = reach * reach * distance
+    np.divide(mass, strength, out=strength, where=distance > 0)
+    result[:, 0] += np.bincount(targets, weights=dx * strength, minlength=len(result))
+    result[:, 1] += np.bincount(targets, weights=dy * strength, minlength=len(result))
+    if result.shape[1] > 2:
+        potential = np.zeros(len(targets))
+        np.divide(-mass, reach, out=potential, where=distance > 0)
+        result[:, 2] += np.bincount(targets, weights=potential, minlength=len(result))
@@ -0,0 +1,114 @@
+from typing import List, Tuple
+
+import numpy as np
+
+
+SELF_POTENTIAL = 4 * np.log(1 + np.sqrt(2)) # The mean of 1 / r over a square cell of size 1 around its center
+
+
+def assignment_weights(scheme: str, positions: np.ndarray) -> List[Tuple[np.ndarray, np.ndarray]]:
+    # The grid points a body at the given (fractional) grid coordinate is spread over, as (index, weight) pairs
+    match scheme:
+        case "cic": # Cloud in cell: the two nearest grid points, linearly
+            base = np.floor(positions).astype(np.int64)
+            fraction = positions - base
+            return [(base, 1 - fraction), (base + 1, fraction)]
+        case "tsc": # Triangular shaped cloud: the nearest grid point and its two neighbours, quadratically
+            nearest = np.rint(positions).astype(np.int64)
+            offset = positions - nearest
+            return [(nearest - 1, 0.5 * (0.5 - offset) ** 2),
+                    (nearest, 0.75 - offset ** 2),
+                    (nearest + 1, 0.5 * (0.5 + offset) ** 2)]
+        case _:
+            raise ValueError(f"Unknown mass assignment scheme: {scheme}. Available: cic, tsc")
+
+
+class ParticleMeshSolver(object):
+    # Approximate O(N + M log M) solver: the masses are spread over a square grid, the potential and the field
+    # are found on the grid with FFT convolutions and interpolated back to the bodies with the same scheme.
+    # The force law m * r / |r|^3 has the Green's function -1 / r, so the convolution is used directly instead of
+    # the spectral Poisson solver of the logarithmic potential. The grid is zero-padded to twice its size, so
+    # the bodies are isolated rather than periodic. Forces are smoothed below the size of a cell
+    def __init__(self,
+                 grid_size: int = 256,
+                 assignment: str = "cic",
+                 region: Tuple[float, float, float, float] = None) -> None:
+        self.grid_size = grid_size
+        self.assignment = assignment
+        self.region = region # (left, top, width, height) that the grid always covers, e.g. the frame
+        self.kernels = self.unit_kernels(grid_size)
+
+        # The grids of the last solve, kept for the heatmap
+        self.left = 0.
+        self.top = 0.
+        self.cell = 1.
+        self.potential = None
+        self.field_x = None
+        self.field_y = None
+
+    @classmethod
+    def from_config(cls, config: dict):
+        width, height = config.get("frame_size_x", 500), config.get("frame_size_y", 500)
+        return cls(grid_size=int(config.get("pm_grid_size", 256)),
+                   assignment=config.get("pm_assignment", "cic"),
+                   region=(-(width // 2), -(height // 2), width, height)) # The frame, in the simulation coordinates
+
+    @staticmethod
+    def unit_kernels(size: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Fourier transforms of the field and potential of a unit mass on a padded grid with cells of size 1
+        offsets = np.arange(2 * size)
+        offsets = np.where(offsets < size, offsets, offsets - 2 * size) # Negative offsets wrap around
+        dx = offsets[:, np.newaxis].astype(np.float64)
+        dy = offsets[np.newaxis, :].astype(np.float64)
+        distance = np.hypot(dx, dy)
+        distance[0, 0] = 1.
+        field_x = -dx / distance ** 3 # The field at the offset (dx, dy) from the mass points back to it
+        field_y = -dy / distance ** 3
+        potential = -1 / distance
+        potential[0, 0] = -SELF_POTENTIAL
+        return np.fft.rfft2(field_x), np.fft.rfft2(field_y), np.fft.rfft2(potential)
+
+    def place_grid(self, x: np.ndarray, y: np.ndarray) -> None:
+        # Cover the bodies and the region, leaving a margin of two cells for the assignment stencils
+        xs = [float(x.min()), float(x.max())] if len(x) else []
+        ys = [float(y.min()), float(y.max())] if len(y) else []
+        if self.region is not None:
+            xs += [self.region[0], self.region[0] + self.region[2]]
+            ys += [self.region[1], self.region[1] + self.region[3]]
+        left, top = min(xs, default=0.), min(ys, default=0.)
+        self.cell = max(max(xs, default=0.) - left, max(ys, default=0.) - top, 1e-12) / (self.grid_size - 5)
+        self.left = left - 2 * self.cell
+        self.top = top - 2 * self.cell
+
+    def solve(self, x: np.ndarray, y: np.ndarray, mass: np.ndarray) -> None:
+        self.place_grid(x, y)
+        size = self.grid_size
+
+        # Deposit the masses onto the grid
+        density = np.zeros((2 * size, 2 * size))
+        for ix, wx in assignment_weights(self.assignment, (x - self.left) / self.cell):
+            for iy, wy in assignment_weights(self.assignment, (y - self.top) / self.cell):
+                density[:size, :size] += np.bincount(ix * size + iy, weights=mass * wx * wy,
+                                                     minlength=size * size).reshape(size, size)
+
+        # Convolve it with the field and the potential of a unit mass
+        transformed = np.fft.rfft2(density)
+        field_x, field_y, potential = self.kernels
+        self.field_x = np.fft.irfft2(transformed * field_x, s=density.shape)[:size, :size] / self.cell ** 2
+        self.field_y = np.fft.irfft2(transformed * field_y, s=density.shape)[:size, :size] / self.cell ** 2
+        self.potential = np.fft.irfft2(transformed * potential, s=density.shape)[:size, :size] / self.cell
+
+    def sample(self, grid: np.ndarray, tx: np.ndarray, ty: np.ndarray) -> np.ndarray:
+        # Interpolate a grid of the last solve to arbitrary points. Points outside the grid get the nearest edge value
+        size = self.grid_size
+        result = np.zeros(np.broadcast(tx, ty).shape)
+        for ix, wx in assignment_weights(self.assignment, (tx - self.left) / self.cell):
+            for iy, wy in assignment_weights(self.assignment, (ty - self.top) / self.cell):
+                result += grid[np.clip(ix, 0, size - 1), np.clip(iy, 0, size - 1)] * wx * wy
+        return result
+
+    def accelerations(self, x: np.ndarray, y: np.ndarray, mass: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if len(x) == 0:
+            return np.zeros(0), np.zeros(0)
+        self.solve(x, y, mass)
+        return self.sample(self.field_x, x, y), self.sample(self.field_y, x, y)
@@ -0,0 +1,63 @@
+from typing import Iterable, List
+
+import numpy as np
+
+from Particle import Particle
+from Vector2D import Vector2D
+
+
+class ParticleStore(object):
+    # Structure-of-arrays storage for the bodies of a simulation. Every attribute is a contiguous array
+    # indexed by the body's position in the store, so the physics can work on whole arrays at once
+    def __init__(self, count: int) -> None:
+        self.x = np.zeros(count, dtype=np.float64)
+        self.y = np.zeros(count, dtype=np.float64)
+        self.vx = np.zeros(count, dtype=np.float64)
+        self.vy = np.zeros(count, dtype=np.float64)
+        self.ax = np.zeros(count, dtype=np.float64)
+        self.ay = np.zeros(count, dtype=np.float64)
+        self.mass = np.zeros(count, dtype=np.float64)
+        self.radius = np.zeros(count, dtype=np.float64)
+        self.id = np.zeros(count, dtype=np.int64)
+
+    @classmethod
+    def from_particles(cls, particles: Iterable[Particle]):
+        particles = list(particles)
+        store = cls(len(particles))
+        for i, particle in enumerate(particles): # Copy the data from Particle objects into the arrays
+            store.x[i] = particle.position.x
+            store.y[i] = particle.position.y
+            store.vx[i] = particle.velocity.x
+            store.vy[i] = particle.velocity.y
+            store.ax[i] = particle.acceleration.x
+            store.ay[i] = particle.acceleration.y
+            store.mass[i] = particle.mass
+            store.radius[i] = particle.radius
+            store.id[i] = particle.id
+        return store
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def particle(self, index: int) -> Particle:
+        # Build a Particle object reflecting the current state of a single body. It is a copy, so changing it
+        # does not affect the store
+        result = Particle(id=int(self.id[index]),
+                          position=Vector2D(float(self.x[index]), float(self.y[index])),
+                          velocity=Vector2D(float(self.vx[index]), float(self.vy[index])),
+                          mass=self.mass[index].item(),
+                          radius=self.radius[index].item())
+        result.acceleration = Vector2D(float(self.ax[index]), float(self.ay[index]))
+        return result
+
+    def to_particles(self) -> List[Particle]: # Used by the GUI list and SaveLoad
+        return [self.particle(i) for i in range(len(self))]
+
+    def positions(self) -> np.ndarray: # Returns a (N, 2) copy of the positions
+        return np.column_stack((self.x, self.y))
+
+    def speeds(self) -> np.ndarray:
+        return np.hypot(self.vx, self.vy)
+
+    def acceleration_magnitudes(self) -> np.ndarray:
+        return np.hypot(self.ax, self.ay)
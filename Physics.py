@@ -0,0 +1,207 @@
+import weakref
+from multiprocessing import cpu_count, get_context, shared_memory
+from typing import Tuple
+
+import numpy as np
+
+import Kernels
+from BarnesHut import BarnesHutSolver
+from Multipole import MultipoleSolver
+from ParticleMesh import ParticleMeshSolver
+
+
+class PairwiseSolver(object):
+    # Reference solver: the acceleration of every body is summed over all the others one body at a time
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls()
+
+    def accelerations(self, x: np.ndarray, y: np.ndarray, mass: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        ax = np.zeros(len(x))
+        ay = np.zeros(len(x))
+        for i in range(len(x)): # For every attracted body...
+            dx = x - x[i] # Get the distances to all the attractors at once
+            dy = y - y[i]
+            distance_squared = dx * dx + dy * dy
+            attracting = distance_squared > 0 # The body does not attract itself
+            strength = np.zeros(len(x))
+            strength[attracting] = mass[attracting] / (distance_squared[attracting] *
+                                                       np.sqrt(distance_squared[attracting]))
+            ax[i] = np.dot(dx, strength)
+            ay[i] = np.dot(dy, strength)
+        return ax, ay
+
+
+class DirectSolver(object):
+    # Exact all-pairs solver. The attracted bodies are processed in blocks of rows, and the accelerations of a
+    # whole block are computed in one broadcasted pass, so the N x N temporaries never exceed memory_budget bytes
+    TEMPORARIES = 4 # The number of block-sized float64 arrays alive at the same time
+
+    def __init__(self, memory_budget: int = 1024 * 1024) -> None:
+        self.memory_budget = memory_budget
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls(memory_budget=int(config.get("direct_memory_budget_mb", 1) * 1024 * 1024))
+
+    def block_size(self, count: int) -> int: # How many attracted bodies fit into one block
+        return max(1, self.memory_budget // (self.TEMPORARIES * 8 * max(count, 1)))
+
+    def accelerations(self, x: np.ndarray, y: np.ndarray, mass: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return self.accelerations_at(x, y, x, y, mass)
+
+    def accelerations_at(self,
+                         tx: np.ndarray,
+                         ty: np.ndarray,
+                         x: np.ndarray,
+                         y: np.ndarray,
+                         mass: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # The accelerations at the target points (tx, ty) created by the bodies. Targets at the very position of a body
+        # are not attracted by it, so the targets may be bodies themselves
+        ax = np.empty(len(tx))
+        ay = np.empty(len(tx))
+        block = self.block_size(len(x))
+        for start in range(0, len(tx), block):
+            stop = min(start + block, len(tx))
+            dx = x[np.newaxis, :] - tx[start:stop, np.newaxis] # Distances from every target of the block
+            dy = y[np.newaxis, :] - ty[start:stop, np.newaxis] # to every attractor
+            strength = dx * dx
+            strength += dy * dy
+            np.multiply(strength, np.sqrt(strength), out=strength) # |r| ^ 3
+            # The self-interaction (and bodies in the very same point) have zero distance, they are masked out and stay 0
+            np.divide(mass[np.newaxis, :], strength, out=strength, where=strength > 0)
+            ax[start:stop] = np.einsum("ij,ij->i", dx, strength)
+            ay[start:stop] = np.einsum("ij,ij->i", dy, strength)
+        return ax, ay
+
+    def accelerations_into(self,
+                           x: np.ndarray,
+                           y: np.ndarray,
+                           mass: np.ndarray,
+                           ax: np.ndarray,
+                           ay: np.ndarray,
+                           first: int,
+                           last: int) -> None:
+        # Write the accelerations of the attracted bodies first..last - 1 into ax and ay
+        ax[first:last], ay[first:last] = self.accelerations_at(x[first:last], y[first:last], x, y, mass)
+
+
+class CompiledSolver(object):
+    # Exact all-pairs solver compiled with numba and run in parallel over the attracted bodies. If numba is not
+    # installed it falls back to DirectSolver
+    def __init__(self, memory_budget: int = 1024 * 1024) -> None:
+        self.fallback = DirectSolver(memory_budget)
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls(memory_budget=int(config.get("direct_memory_budget_mb", 1) * 1024 * 1024))
+
+    def accelerations(self, x: np.ndarray, y: np.ndarray, mass: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if not Kernels.NUMBA_AVAILABLE:
+            return self.fallback.accelerations(x, y, mass)
+        ax = np.empty(len(x))
+        ay = np.empty(len(x))
+        Kernels.compiled_accelerations(x, y, mass, ax, ay)
+        return ax, ay
+
+
+SHARED_FIELDS = 5 # x, y, mass, ax and ay are stored in one shared memory block as rows of a (5, capacity) array
+attached_blocks = {} # The blocks a worker process is attached to, by name
+
+
+def attach_block(name: str, capacity: int) -> np.ndarray:
+    if name not in attached_blocks: # The block is replaced when it grows, so forget the old one
+        for block, _ in attached_blocks.values():
+            block.close()
+        attached_blocks.clear()
+        block = shared_memory.SharedMemory(name=name)
+        attached_blocks[name] = (block, np.ndarray((SHARED_FIELDS, capacity), dtype=np.float64, buffer=block.buf))
+    return attached_blocks[name][1]
+
+
+def parallel_worker(name: str, capacity: int, count: int, first: int, last: int, memory_budget: int) -> None:
+    # Runs in a worker process: the accelerations of the bodies first..last - 1 are written straight into the block
+    x, y, mass, ax, ay = attach_block(name, capacity)[:, :count]
+    DirectSolver(memory_budget).accelerations_into(x, y, mass, ax, ay, first, last)
+
+
+def release_resources(resources: dict) -> None:
+    if resources["pool"] is not None:
+        resources["pool"].terminate()
+    if resources["block"] is not None:
+        resources["block"].close()
+        resources["block"].unlink()
+
+
+class ParallelSolver(object):
+    # Exact all-pairs solver that splits the attracted bodies between a pool of worker processes. Positions and
+    # masses are passed through shared memory instead of being pickled, and the workers write the accelerations
+    # back into it in place
+    def __init__(self, workers: int = 0, memory_budget: int = 1024 * 1024) -> None:
+        self.workers = workers if workers > 0 else cpu_count()
+        self.memory_budget = memory_budget
+        self.capacity = 0
+        self.data = None
+        self.resources = {"pool": None, "block": None}
+        weakref.finalize(self, release_resources, self.resources) # Stop the workers when the solver is not used anymore
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls(workers=int(config.get("parallel_workers", 0)),
+                   memory_budget=int(config.get("direct_memory_budget_mb", 1) * 1024 * 1024))
+
+    def reserve(self, count: int) -> None:
+        if count > self.capacity:
+            if self.resources["block"] is not None:
+                self.data = None
+                self.resources["block"].close()
+                self.resources["block"].unlink()
+            self.capacity = max(count, 2 * self.capacity) # Grow geometrically, so that adding bodies is cheap
+            block = shared_memory.SharedMemory(create=True, size=SHARED_FIELDS * self.capacity * 8)
+            self.resources["block"] = block
+            self.data = np.ndarray((SHARED_FIELDS, self.capacity), dtype=np.float64, buffer=block.buf)
+        # The pool is started after the first block, so that the workers share the resource tracker of this process
+        # and do not try to remove the blocks they have only attached to when they exit
+        if self.resources["pool"] is None: # Forking a process that has run the compiled kernels on threads is unsafe
+            self.resources["pool"] = get_context("spawn").Pool(self.workers)
+
+    def close(self) -> None:
+        self.data = None
+        release_resources(self.resources)
+        self.resources["pool"] = None
+        self.resources["block"] = None
+        self.capacity = 0
+
+    def accelerations(self, x: np.ndarray, y: np.ndarray, mass: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        count = len(x)
+        if count == 0:
+            return np.zeros(0), np.zeros(0)
+        self.reserve(count)
+        self.data[0, :count] = x
+        self.data[1, :count] = y
+        self.data[2, :count] = mass
+        bounds = np.linspace(0, count, self.workers + 1).astype(np.int64) # Every pair costs the same, so equal parts
+        self.resources["pool"].starmap(parallel_worker,
+                                       [(self.resources["block"].name, self.capacity, count, first, last,
+                                         self.memory_budget)
+                                        for first, last in zip(bounds[:-1], bounds[1:]) if last > first])
+        # The block is overwritten on the next call, so the results are copied out of it
+        return self.data[3, :count].copy(), self.data[4, :count].copy()
+
+
+BACKENDS = {
+    "pairwise": PairwiseSolver,
+    "direct": DirectSolver,
+    "barnes_hut": BarnesHutSolver,
+    "fmm": MultipoleSolver,
+    "particle_mesh": ParticleMeshSolver,
+    "parallel": ParallelSolver,
+    "numba": CompiledSolver,
+}
+
+
+def make_solver(config: dict): # Create the solver selected in the SIMULATION section of the config
+    backend = config.get("backend", "direct")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown physics backend: {backend}. Available: {', '.join(BACKENDS)}")
+    return BACKENDS[backend].from_config(config)
@@ -0,0 +1,388 @@
+import time
+import weakref
+from multiprocessing import get_context, shared_memory
+from queue import Queue, Empty, Full
+from threading import Event, Lock, Thread
+from typing import Tuple
+
+import numpy as np
+
+from Frames import Frame
+from History import History
+from Simulation import Simulation
+
+
+class Snapshot(object):
+    # The steps a simulation made since the previous snapshot, copied so that the physics can go on while they are
+    # drawn: the steps, and the positions, velocities and accelerations of shape (steps, bodies, 2). The last of them
+    # is the state the frame shows
+    def __init__(self,
+                 steps: np.ndarray,
+                 positions: np.ndarray,
+                 velocities: np.ndarray,
+                 accelerations: np.ndarray,
+                 time: float,
+                 velocity_range: Tuple[float, float],
+                 acceleration_range: Tuple[float, float]) -> None:
+        self.steps = steps
+        self.positions = positions
+        self.velocities = velocities
+        self.accelerations = accelerations
+        self.time = time
+        self.velocity_range = velocity_range
+        self.acceleration_range = acceleration_range
+
+    @classmethod
+    def from_simulation(cls, simulation: Simulation, since: int):
+        # The steps after `since` that are still in the history of the simulation
+        return cls(*simulation.history.since(since),
+                   time=simulation.time,
+                   velocity_range=(simulation.minVelocity, simulation.maxVelocity),
+                   acceleration_range=(simulation.minAcceleration, simulation.maxAcceleration))
+
+    def apply(self, simulation: Simulation) -> None:
+        # Make the last state the current one of a simulation, after adding all the steps to its history
+        store = simulation.store
+        simulation.history.extend(self.steps, self.positions, self.velocities, self.accelerations)
+        store.x[:], store.y[:] = self.positions[-1, :, 0], self.positions[-1, :, 1]
+        store.vx[:], store.vy[:] = self.velocities[-1, :, 0], self.velocities[-1, :, 1]
+        store.ax[:], store.ay[:] = self.accelerations[-1, :, 0], self.accelerations[-1, :, 1]
+        simulation.frameCounter = int(self.steps[-1])
+        simulation.time = self.time
+        simulation.minVelocity, simulation.maxVelocity = self.velocity_range
+        simulation.minAcceleration, simulation.maxAcceleration = self.acceleration_range
+        simulation.state_changed()
+
+    def follow(self, previous: "Snapshot", limit: int) -> None:
+        # Take over the steps of a snapshot that is dropped before this one, so that the trails do not miss them. Only
+        # the last `limit` steps are kept, the history would not keep more
+        self.steps = np.concatenate((previous.steps, self.steps))[-limit:]
+        self.positions = np.concatenate((previous.positions, self.positions))[-limit:]
+        self.velocities = np.concatenate((previous.velocities, self.velocities))[-limit:]
+        self.accelerations = np.concatenate((previous.accelerations, self.accelerations))[-limit:]
+
+
+class SharedSnapshots(object):
+    # Two snapshot buffers in shared memory, written one after the other by the physics process and copied out by the
+    # GUI process, so nothing is pickled. header[0] is the sequence number of the newest snapshot, which is in the
+    # buffer sequence % 2, header[1] the newest one the reader took and header[2] the one it is copying, if any.
+    # Every buffer is stamped with the sequence number of its snapshot, and with -1 while it is written: a copy
+    # that did not see the same stamp before and after is discarded. The writer does not overwrite the buffer that
+    # is being copied, it keeps the snapshot and writes it with the next one
+    HEADER = 3
+    META = 7 # The stamp, the number of steps, the time, the velocity range and the acceleration range
+
+    def __init__(self, count: int, capacity: int, name: str = None) -> None:
+        self.count = count
+        self.capacity = max(capacity, 1) # The most steps a buffer holds, the older ones of a snapshot are dropped
+        words = self.META + self.capacity + self.capacity * count * 2 + 2 * count * 2 # Of a buffer
+        self.block = shared_memory.SharedMemory(name=name, create=name is None, size=8 * (self.HEADER + 2 * words))
+        self.header = np.ndarray(self.HEADER, dtype=np.int64, buffer=self.block.buf)
+        self.buffers = []
+        for index in range(2):
+            data = np.ndarray(words, dtype=np.float64, buffer=self.block.buf, offset=8 * (self.HEADER + index * words))
+            positions = data[self.META + self.capacity:self.META + self.capacity + self.capacity * count * 2]
+            velocities = data[self.META + self.capacity + self.capacity * count * 2:]
+            self.buffers.append({"meta": data[:self.META],
+                                 "steps": data[self.META:self.META + self.capacity],
+                                 "positions": positions.reshape(self.capacity, count, 2),
+                                 "velocities": velocities[:count * 2].reshape(count, 2),
+                                 "accelerations": velocities[count * 2:].reshape(count, 2)})
+        self.written = None # The newest snapshot the writer has written, until the reader takes it
+        self.pending = None # A snapshot the writer could not write yet
+
+    @property
+    def name(self) -> str:
+        return self.block.name
+
+    def write(self, snapshot: Snapshot) -> bool:
+        # Publish a snapshot. It is merged with the previous one if the reader has not taken that, so that the trails
+        # do not miss its steps. Returns False if the snapshot is kept for the next call, see flush
+        sequence = int(self.header[0]) + 1
+        if self.pending is not None:
+            snapshot.follow(self.pending, self.capacity)
+            self.pending = None
+        if self.header[2] == sequence - 2 and sequence > 2: # The reader is copying the buffer of this sequence
+            self.pending = snapshot
+            return False
+        if self.written is not None and self.header[1] < sequence - 1:
+            snapshot.follow(self.written, self.capacity)
+        buffer = self.buffers[sequence % 2]
+        steps = min(len(snapshot.steps), self.capacity)
+        buffer["meta"][0] = -1
+        buffer["meta"][1:] = (steps, snapshot.time) + tuple(snapshot.velocity_range) + tuple(snapshot.acceleration_range)
+        buffer["steps"][:steps] = snapshot.steps[-steps:]
+        buffer["positions"][:steps] = snapshot.positions[-steps:]
+        buffer["velocities"][:] = snapshot.velocities[-1]
+        buffer["accelerations"][:] = snapshot.accelerations[-1]
+        buffer["meta"][0] = sequence
+        self.header[0] = sequence
+        self.written = snapshot
+        return True
+
+    def flush(self) -> None:
+        # Write the snapshot that was kept, waiting for the reader to finish copying
+        while self.pending is not None:
+            pending, self.pending = self.pending, None
+            if not self.write(pending):
+                time.sleep(0.001)
+
+    def read(self, last: int) -> Tuple[int, Snapshot]:
+        # The newest snapshot and its sequence number, or (last, None) if there is no newer one than `last` or it
+        # was overwritten while it was copied
+        sequence = int(self.header[0])
+        if sequence == last or sequence == 0:
+            return last, None
+        self.header[2] = sequence
+        snapshot = self.copy(sequence)
+        self.header[2] = 0
+        if snapshot is None:
+            return last, None
+        self.header[1] = sequence
+        return sequence, snapshot
+
+    def latest(self) -> Snapshot:
+        # The newest snapshot, when the writer has stopped
+        return self.copy(int(self.header[0]))
+
+    def copy(self, sequence: int) -> Snapshot:
+        buffer = self.buffers[sequence % 2]
+        if buffer["meta"][0] != sequence:
+            return None
+        meta = buffer["meta"].copy()
+        steps = int(meta[1])
+        positions = buffer["positions"][:steps].copy()
+        # Only the newest velocities and accelerations are kept, the drawing does not use the older ones
+        velocities = np.broadcast_to(buffer["velocities"].copy(), positions.shape)
+        accelerations = np.broadcast_to(buffer["accelerations"].copy(), positions.shape)
+        snapshot = Snapshot(buffer["steps"][:steps].astype(np.int64), positions, velocities, accelerations,
+                            time=float(meta[2]),
+                            velocity_range=(float(meta[3]), float(meta[4])),
+                            acceleration_range=(float(meta[5]), float(meta[6])))
+        if buffer["meta"][0] != sequence: # The writer has started on this buffer meanwhile
+            return None
+        return snapshot
+
+    def close(self) -> None:
+        self.buffers = []
+        self.header = None
+        self.block.close()
+
+
+class SimulationPipeline(object):
+    # Runs a simulation as fast as it goes in a physics thread, which puts a snapshot into a short queue after every
+    # `steps_per_frame` steps, and draws the snapshots in a render thread. The GUI takes the newest drawn frame when it
+    # is ready for one. Nothing waits for a slower stage: the oldest snapshot is dropped when the queue is full, and a
+    # drawn frame that the GUI has not taken yet is replaced by the next one. Only the drawing simulation keeps the
+    # history the trails are drawn from: the simulation keeps the steps of one snapshot, and gets the history back
+    # when the pipeline stops
+    def __init__(self, simulation: Simulation, steps_per_frame: int = 1, queue_length: int = 2) -> None:
+        self.simulation = simulation
+        self.steps_per_frame = max(steps_per_frame, 1)
+        self.drawing = Simulation.for_drawing(simulation.particles, simulation.framesize, simulation.config)
+        simulation.history = History(len(simulation.store), length=self.steps_per_frame, decimated_length=0)
+        simulation.history.record(simulation.frameCounter, simulation.store)
+        self.profiler = simulation.profiler # The stages of both threads are timed together
+        self.drawing.profiler = self.profiler
+        self.snapshots = Queue(max(queue_length, 1))
+        self.options = {} # The keyword arguments of Simulation.render, set by the GUI before the start
+        self.frame = None # The newest drawn frame the GUI has not taken yet
+        self.frame_lock = Lock()
+        self.running = Event()
+        self.threads = []
+        self.produced = 0 # Counters of the snapshots, for the statistics
+        self.dropped = 0
+        self.drawn = 0
+
+    def start(self) -> None:
+        self.running.set()
+        self.threads = [Thread(target=self.physics_cycle, daemon=True), Thread(target=self.render_cycle, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self) -> None:
+        # Wait for the threads, the simulation is not changed after this
+        self.running.clear()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        frame = self.take_frame()
+        if frame is not None: # Drawn but not shown
+            frame.release()
+        while not self.snapshots.empty(): # The steps that were not drawn belong to the history as well
+            self.snapshots.get_nowait().apply(self.drawing)
+        self.return_history()
+
+    def return_history(self) -> None:
+        # Give the history of the drawn steps back to the simulation
+        self.simulation.history = self.drawing.history
+        self.simulation.trailStep = None
+
+    def take_frame(self) -> Frame:
+        # The newest drawn frame, or None if there is no new one since the last call. The GUI releases it when it
+        # shows the next one
+        with self.frame_lock:
+            frame, self.frame = self.frame, None
+        return frame
+
+    def physics_cycle(self) -> None:
+        while self.running.is_set():
+            since = self.simulation.frameCounter
+            with self.profiler.section("physics"):
+                self.simulation.advance(self.steps_per_frame) # Make the substeps, then draw only the last one
+            with self.profiler.section("snapshot"):
+                snapshot = Snapshot.from_simulation(self.simulation, since)
+            self.produced += 1
+            try:
+                self.snapshots.put_nowait(snapshot)
+            except Full: # The drawing falls behind, it gets the newest state with the steps of all the waiting ones
+                waiting = []
+                while True:
+                    try:
+                        waiting.append(self.snapshots.get_nowait())
+                    except Empty:
+                        break
+                for previous in reversed(waiting): # The newest first, each one goes before the steps taken so far
+                    snapshot.follow(previous, self.drawing.history.length)
+                self.dropped += len(waiting)
+                self.snapshots.put_nowait(snapshot) # Only this thread puts, so there is room now
+
+    def next_snapshot(self) -> Snapshot:
+        # The next snapshot to draw, or None if there is none for a while
+        try:
+            return self.snapshots.get(timeout=0.1)
+        except Empty:
+            return None
+
+    def render_cycle(self) -> None:
+        while self.running.is_set():
+            snapshot = self.next_snapshot()
+            if snapshot is None:
+                continue
+            with self.profiler.section("render"):
+                frame = self.render(snapshot, self.options)
+            self.drawn += 1
+            with self.frame_lock:
+                previous, self.frame = self.frame, frame
+            if previous is not None: # The GUI did not take it, its buffer can be drawn into again
+                previous.release()
+
+    def render(self, snapshot: Snapshot, options: dict) -> Frame:
+        # Draw the last state of a snapshot with the drawing simulation, which has only the drawn steps
+        if options.get("draw_trails"): # Before the steps are added, a history that is not allocated keeps only the newest
+            self.drawing.history.allocate()
+        snapshot.apply(self.drawing)
+        return self.drawing.render(**options)
+
+
+def physics_process(particles: list,
+                    framesize: Tuple[int, int],
+                    config: dict,
+                    steps_per_frame: int,
+                    name: str,
+                    capacity: int,
+                    stop,
+                    published) -> None:
+    # Runs in the child process of ProcessPipeline: the simulation goes on until `stop` is set, and a snapshot is
+    # written to the shared buffers after every frame's steps. `published` wakes the reader up
+    simulation = Simulation(particles, framesize, config)
+    simulation.history.allocate() # The snapshots take all the steps of a frame from it
+    channel = SharedSnapshots(len(simulation.store), capacity, name)
+    channel.write(Snapshot.from_simulation(simulation, -1))
+    published.set()
+    while not stop.is_set():
+        since = simulation.frameCounter
+        simulation.advance(steps_per_frame)
+        if channel.write(Snapshot.from_simulation(simulation, since)):
+            published.set()
+    simulation.close() # Finish the trajectory file
+    channel.flush() # The last state is read when the process has finished
+    channel.close()
+
+
+def release_channel(resources: dict) -> None:
+    if resources["process"] is not None:
+        resources["stop"].set()
+        resources["process"].join()
+    if resources["channel"] is not None:
+        resources["channel"].close()
+        resources["channel"].block.unlink()
+
+
+class ProcessPipeline(SimulationPipeline):
+    # The same pipeline with the physics in a child process, so that it does not compete with the drawing and the
+    # GUI for the GIL, and a slow step does not slow the frame rate down. The snapshots come through SharedSnapshots
+    # instead of the queue. The simulation given to it only gets the final state when the pipeline stops: it should
+    # not record a trajectory itself, the child process does that with `config`, which has the trajectory file
+    MEMORY_LIMIT = 64 * 1024 * 1024 # The steps a snapshot holds are limited so that the buffers take at most this
+
+    def __init__(self, simulation: Simulation, steps_per_frame: int = 1, capacity: int = 256, config: dict = None) -> None:
+        super(ProcessPipeline, self).__init__(simulation, steps_per_frame)
+        self.config = simulation.config if config is None else config # Of the simulation in the child process
+        self.capacity = max(1, min(capacity, self.MEMORY_LIMIT // (32 * max(len(simulation.store), 1))))
+        self.sequence = 0 # The newest snapshot taken from the channel
+        self.context = get_context("spawn") # Like the heatmap workers, see HeatmapPool.executor
+        self.stop_event = self.context.Event()
+        self.published = self.context.Event()
+        self.resources = {"process": None, "channel": None, "stop": self.stop_event}
+        weakref.finalize(self, release_channel, self.resources) # Stop the process if the pipeline is not stopped
+
+    @classmethod
+    def from_config(cls, simulation: Simulation, config: dict):
+        # config is the whole config, the child process runs with it
+        return cls(simulation,
+                   steps_per_frame=int(config["SIMULATION"].get("steps_per_frame", 1)),
+                   capacity=int(config["SIMULATION"].get("process_snapshot_steps", 256)),
+                   config=config)
+
+    def start(self) -> None:
+        simulation = self.simulation
+        channel = SharedSnapshots(len(simulation.store), self.capacity)
+        self.resources["channel"] = channel
+        process = self.context.Process(target=physics_process,
+                                       args=(simulation.particles, simulation.framesize, self.child_config(),
+                                             self.steps_per_frame, channel.name, self.capacity,
+                                             self.stop_event, self.published),
+                                       daemon=True)
+        self.resources["process"] = process
+        process.start()
+        self.running.set()
+        self.threads = [Thread(target=self.render_cycle, daemon=True)]
+        self.threads[0].start()
+
+    def child_config(self) -> dict:
+        # The child only keeps the steps of one snapshot in its history, the drawing keeps the ones of the trails
+        return dict(self.config, SIMULATION=dict(self.config["SIMULATION"],
+                                                 history_length=self.steps_per_frame,
+                                                 history_decimated_length=0))
+
+    def stop(self) -> None:
+        # Wait for the render thread and the process, then bring the simulation to the final state
+        self.running.clear()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        frame = self.take_frame()
+        if frame is not None:
+            frame.release()
+        self.stop_event.set()
+        self.resources["process"].join()
+        self.resources["process"] = None
+        self.return_history()
+        final = self.resources["channel"].latest()
+        if final is not None: # Its steps that were drawn already are not added to the history again
+            final.apply(self.simulation)
+        release_channel(self.resources)
+        self.resources["channel"] = None
+
+    def next_snapshot(self) -> Snapshot:
+        if not self.published.wait(0.1):
+            return None
+        self.published.clear() # Before reading, so that a snapshot written meanwhile sets it again
+        with self.profiler.section("snapshot"):
+            sequence, snapshot = self.resources["channel"].read(self.sequence)
+        if snapshot is not None:
+            self.produced = sequence
+            self.dropped = sequence - self.drawn - 1
+            self.sequence = sequence
+        return snapshot
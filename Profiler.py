@@ -0,0 +1,52 @@
+import time
+from contextlib import contextmanager, nullcontext
+from threading import Lock
+from typing import ContextManager
+
+
+class FrameProfiler(object):
+    # Measures where the time of a frame goes: the stages are timed as named sections, which add up their count,
+    # total and longest time. The physics, render and GUI threads time their stages into the same profiler. It is
+    # off unless DRAWING.profile_frames is set, a section then costs nothing but the call
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.sections = {} # name: [count, total seconds, longest seconds], in the order they were first timed
+        self.lock = Lock()
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls(enabled=bool(config.get("profile_frames", False)))
+
+    def section(self, name: str) -> ContextManager:
+        # with profiler.section("render.trails"): ...
+        if not self.enabled:
+            return nullcontext()
+        return self.timed(name)
+
+    @contextmanager
+    def timed(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float) -> None:
+        with self.lock:
+            section = self.sections.setdefault(name, [0, 0., 0.])
+            section[0] += 1
+            section[1] += seconds
+            section[2] = max(section[2], seconds)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.sections = {}
+
+    def report(self) -> str:
+        # A table of the sections: how often they ran, and their mean and longest time in milliseconds
+        with self.lock:
+            sections = {name: tuple(values) for name, values in self.sections.items()}
+        lines = [f"{'section':<20} {'count':>7} {'mean, ms':>9} {'max, ms':>9} {'total, s':>9}"]
+        for name, (count, total, longest) in sections.items():
+            lines.append(f"{name:<20} {count:>7} {1000 * total / count:>9.2f} {1000 * longest:>9.2f} {total:>9.3f}")
+        return "\n".join(lines)
@@ -0,0 +1,187 @@
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from BarnesHut import ragged_arange
+
+
+RADIUS_STEP = 0.25 # The radii of the discs are rounded to this, so that bodies of similar sizes share a stamp
+DENSITY_FLOOR = 96 # The least opacity of a pixel of the density map, 0 to 255, so that single bodies stay visible
+
+Stamp = Tuple[np.ndarray, np.ndarray, np.ndarray] # The x and y offsets of the pixels and their opacities, 0 to 255
+
+
+def pack_colors(colors) -> np.ndarray:
+    # RGB colors, a color or an array of shape (..., 3), as the packed 0xFFRRGGBB pixels of the frames
+    colors = np.asarray(colors).astype(np.uint32)
+    return np.uint32(0xFF000000) | colors[..., 0] << 16 | colors[..., 1] << 8 | colors[..., 2]
+
+
+def disc_stamp(radius: float) -> Stamp:
+    # The pixels of a filled disc around its center, 2 * radius + 1 pixels across like ImageDraw.ellipse. The
+    # threshold r * (r + 1) instead of r^2 rounds the edge without single pixels sticking out at the axes
+    extent = int(np.ceil(radius))
+    dy, dx = np.mgrid[-extent:extent + 1, -extent:extent + 1]
+    inside = dx * dx + dy * dy <= radius * (radius + 1)
+    return dx[inside], dy[inside], np.full(int(inside.sum()), 255, dtype=np.uint16)
+
+
+def glyph_stamp(character: str) -> Stamp:
+    # The pixels ImageDraw.text sets for a character of the default font, relative to the point the text is drawn at
+    left, top, right, bottom = ImageDraw.Draw(Image.new("L", (1, 1))).textbbox((0, 0), character)
+    image = Image.new("L", (max(right, 0) + 1, max(bottom, 0) + 1))
+    ImageDraw.Draw(image).text((0, 0), character, fill=255)
+    alpha = np.asarray(image)
+    dy, dx = np.nonzero(alpha)
+    return dx, dy, alpha[dy, dx].astype(np.uint16)
+
+
+def concatenate_stamps(keys: np.ndarray, stamps: List[Stamp]) -> Tuple[np.ndarray, ...]:
+    # The stamps of many items, the item i getting stamps[keys[i]], concatenated in the order of the items: the item
+    # every pixel belongs to, and the offsets and opacities of the pixels
+    lengths = np.array([len(stamp[0]) for stamp in stamps], dtype=np.int64)
+    starts = np.cumsum(lengths) - lengths
+    rows = ragged_arange(starts[keys], lengths[keys])
+    table = [np.concatenate([stamp[part] for stamp in stamps]) if stamps else np.zeros(0, dtype=np.int64) for part in range(3)]
+    item = np.repeat(np.arange(len(keys)), lengths[keys])
+    return item, table[0][rows].astype(np.int64), table[1][rows].astype(np.int64), table[2][rows].astype(np.uint16)
+
+
+def clip_segments(x0: np.ndarray, y0: np.ndarray, x1: np.ndarray, y1: np.ndarray, width: int, height: int) -> Tuple[np.ndarray, ...]:
+    # The parts of the segments inside the frame, the ones outside of it are left out. A long velocity vector would
+    # otherwise take a pixel for every step of its length. The last array tells which segments are kept
+    start, end = np.zeros(len(x0)), np.ones(len(x0)) # The part of every segment that is kept, as fractions
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for origin, delta, limit in ((x0, x1 - x0, width - 1), (y0, y1 - y0, height - 1)):
+            low, high = (0 - origin) / delta, (limit - origin) / delta
+            parallel = delta == 0 # Inside for the whole length or not at all
+            low[parallel] = np.where((origin[parallel] >= 0) & (origin[parallel] <= limit), -np.inf, np.inf)
+            high[parallel] = np.inf
+            start = np.maximum(start, np.minimum(low, high))
+            end = np.minimum(end, np.maximum(low, high))
+    keep = start <= end # False for NaN too
+    dx, dy = (x1 - x0)[keep], (y1 - y0)[keep]
+    return (x0[keep] + start[keep] * dx, y0[keep] + start[keep] * dy,
+            x0[keep] + end[keep] * dx, y0[keep] + end[keep] * dy, keep)
+
+
+class BatchRasterizer(object):
+    # Draws all the bodies of a frame into an array of packed pixels (see pack_colors) with a few NumPy operations
+    # instead of a PIL call per body, so that there is one array element per pixel and no channel to step through.
+    # The pixels of every body's disc and label are looked up once, as offsets from its position, and only moved
+    # with the bodies; they are made again when the radii or the ids change
+    def __init__(self, framesize: Tuple[int, int]) -> None:
+        self.width, self.height = framesize
+        self.discs = None # concatenate_stamps of the discs of the bodies
+        self.discRadii = None # The radii they were made for
+        self.labels = None # concatenate_stamps of the labels of the bodies, the offsets include the characters' positions
+        self.labelIds = None # The ids they were made for
+        self.glyphs = {} # The stamps of the characters
+
+    def draw_discs(self, frame: np.ndarray, x: np.ndarray, y: np.ndarray, radius: np.ndarray, colors: np.ndarray) -> None:
+        # Filled discs at (x, y) in frame coordinates, RGB colors of shape (bodies, 3). A body is drawn over the ones
+        # before it, like with one ImageDraw.ellipse per body
+        if self.discRadii is None or not np.array_equal(self.discRadii, radius):
+            keys, inverse = np.unique(np.round(radius / RADIUS_STEP), return_inverse=True)
+            self.discs = concatenate_stamps(inverse.ravel(), [disc_stamp(key * RADIUS_STEP) for key in keys])
+            self.discRadii = radius.copy()
+        body, dx, dy, _ = self.discs
+        self.put(frame, np.floor(x).astype(np.int64)[body] + dx, np.floor(y).astype(np.int64)[body] + dy,
+                 pack_colors(colors)[body])
+
+    def draw_points(self, frame: np.ndarray, x: np.ndarray, y: np.ndarray, colors: np.ndarray) -> None:
+        # One pixel for every body, the pixel its disc would be centered on, e.g. for the bodies too small for a disc
+        self.put(frame, np.floor(x).astype(np.int64), np.floor(y).astype(np.int64), pack_colors(colors))
+
+    def draw_density(self, frame: np.ndarray, x: np.ndarray, y: np.ndarray, colors: np.ndarray) -> None:
+        # The bodies binned by pixel: every pixel with bodies gets their mean color, over what is under it with an
+        # opacity growing with the logarithm of their count, from DENSITY_FLOOR up to opaque for the densest pixel
+        px, py = np.floor(x).astype(np.int64), np.floor(y).astype(np.int64)
+        inside = (px >= 0) & (px < self.width) & (py >= 0) & (py < self.height)
+        if not inside.any():
+            return
+        cells, body_cell, counts = np.unique(py[inside] * self.width + px[inside], return_inverse=True, return_counts=True)
+        body_colors = colors[inside]
+        mean = np.stack([np.bincount(body_cell, weights=body_colors[:, channel], minlength=len(cells))
+                         for channel in range(3)], axis=1) / counts[:, np.newaxis]
+        level = np.log1p(counts) / np.log1p(counts.max())
+        opacity = np.rint(DENSITY_FLOOR + (255 - DENSITY_FLOOR) * level).astype(np.uint16)
+        self.put(frame, cells % self.width, cells // self.width, pack_colors(np.rint(mean)), opacity)
+
+    def draw_disc(self, frame: np.ndarray, x: float, y: float, radius: float, color: tuple) -> None:
+        # One disc, e.g. the barycenter, without touching the stamps of the bodies
+        dx, dy, _ = disc_stamp(radius)
+        self.put(frame, int(np.floor(x)) + dx, int(np.floor(y)) + dy, pack_colors(color))
+
+    def draw_labels(self, frame: np.ndarray, x: np.ndarray, y: np.ndarray, ids: np.ndarray, color: tuple) -> None:
+        # The ids of the bodies with the default font, with their top left corners at (x, y) like ImageDraw.text
+        if self.labelIds is None or not np.array_equal(self.labelIds, ids):
+            self.labels = self.make_labels(ids)
+            self.labelIds = ids.copy()
+        body, dx, dy, opacity = self.labels
+        self.put(frame, x.astype(np.int64)[body] + dx, y.astype(np.int64)[body] + dy, pack_colors(color), opacity)
+
+    def make_labels(self, ids: np.ndarray) -> Tuple[np.ndarray, ...]:
+        labels = [str(int(body_id)) for body_id in ids]
+        lengths = np.array([len(label) for label in labels], dtype=np.int64)
+        characters = sorted(set("".join(labels)))
+        for character in characters:
+            if character not in self.glyphs:
+                self.glyphs[character] = glyph_stamp(character)
+        font = ImageDraw.Draw(Image.new("L", (1, 1))).getfont()
+        codes = {character: index for index, character in enumerate(characters)}
+        keys = np.array([codes[character] for label in labels for character in label], dtype=np.int64)
+        advances = np.array([font.getlength(character) for character in characters])[keys]
+        starts = np.cumsum(lengths) - lengths # The first character of every label
+        positions = np.cumsum(advances) - advances # Where every character starts, from the start of its label
+        positions -= np.repeat(positions[starts], lengths)
+        character, dx, dy, opacity = concatenate_stamps(keys, [self.glyphs[character] for character in characters])
+        body = np.repeat(np.arange(len(labels)), lengths)[character]
+        return body, dx + np.rint(positions[character]).astype(np.int64), dy, opacity
+
+    def draw_lines(self, frame: np.ndarray, x0: np.ndarray, y0: np.ndarray, x1: np.ndarray, y1: np.ndarray, color: tuple) -> None:
+        # One pixel wide segments from (x0, y0) to (x1, y1)
+        _, px, py = self.line_pixels(x0, y0, x1, y1)
+        self.put(frame, px, py, pack_colors(color))
+
+    def draw_segments(self, layer: np.ndarray, x0: np.ndarray, y0: np.ndarray, x1: np.ndarray, y1: np.ndarray,
+                      values: np.ndarray) -> None:
+        # The same segments with a value of their own into a layer of any type, e.g. the brightness of the trails. A
+        # segment is drawn over the ones before it
+        line, px, py = self.line_pixels(x0, y0, x1, y1)
+        self.put(layer, px, py, values[line])
+
+    def line_pixels(self, x0: np.ndarray, y0: np.ndarray, x1: np.ndarray, y1: np.ndarray) -> Tuple[np.ndarray, ...]:
+        # The pixels of the segments inside the frame, in the order of the segments: the segment every pixel belongs
+        # to, and the coordinates of the pixels. Like the Bresenham lines of ImageDraw.line, the coordinates of the ends
+        # are truncated to pixels, and there is a pixel for every step along the longer axis with the other coordinate
+        # rounded half up
+        x0, y0, x1, y1, keep = clip_segments(np.trunc(x0), np.trunc(y0), np.trunc(x1), np.trunc(y1), self.width, self.height)
+        x0, y0, x1, y1 = (np.rint(coordinate).astype(np.int64) for coordinate in (x0, y0, x1, y1))
+        dx, dy = np.abs(x1 - x0), np.abs(y1 - y0)
+        major, minor = np.maximum(dx, dy), np.minimum(dx, dy)
+        line = np.repeat(np.arange(len(major)), major + 1)
+        along = ragged_arange(np.zeros(len(major), dtype=np.int64), major + 1)
+        across = (2 * along * minor[line] + major[line]) // np.maximum(2 * major, 1)[line]
+        along_x = (dx > dy)[line]
+        return (np.flatnonzero(keep)[line],
+                x0[line] + np.sign(x1 - x0)[line] * np.where(along_x, along, across),
+                y0[line] + np.sign(y1 - y0)[line] * np.where(along_x, across, along))
+
+    def put(self, frame: np.ndarray, px: np.ndarray, py: np.ndarray, colors: np.ndarray, opacity: np.ndarray = None) -> None:
+        # Set the pixels that are inside the frame. colors is one packed color, or one per pixel. Of the pixels set more
+        # than once the last one is kept
+        inside = (px >= 0) & (px < self.width) & (py >= 0) & (py < self.height)
+        index = py[inside] * self.width + px[inside]
+        if colors.ndim == 1:
+            colors = colors[inside]
+        pixels = frame.reshape(-1)
+        if opacity is None:
+            pixels[index] = colors
+        else: # Blend antialiased pixels with what is under them byte by byte, in integers: 255 * 255 still fits into uint16
+            alpha = opacity[inside][:, np.newaxis]
+            under = pixels[index].view(np.uint8).reshape(-1, 4)
+            over = np.atleast_1d(colors).view(np.uint8).reshape(-1, 4).astype(np.uint16)
+            blended = (under * (255 - alpha) + over * alpha + 127) // 255
+            pixels[index] = blended.astype(np.uint8).view(np.uint32).ravel()
@@ -0,0 +1,94 @@
+import math
+from typing import Iterable
+
+import numpy as np
+
+from Frames import Frame
+from ParticleStore import ParticleStore
+from Simulation import Simulation
+from Trajectory import load_bodies, open_trajectory
+
+
+class Replay(object):
+    # Shows the records of a trajectory file with the drawing of Simulation. The file is memory-mapped, and only the
+    # records a frame needs are read: the shown one, and the ones before it for the trails
+    SAMPLES = 100 # The number of records the ranges of the velocity and the acceleration are estimated from
+
+    def __init__(self, filename: str, framesize: tuple[int, int], config: dict = None) -> None:
+        self.trajectory = open_trajectory(filename)
+        particles = load_bodies(filename)
+        if self.trajectory.dtype["positions"].shape[0] != len(particles):
+            raise ValueError(f"The trajectory has {self.trajectory.dtype['positions'].shape[0]} bodies, "
+                             f"its bodies file {len(particles)}")
+        self.simulation = Simulation.for_drawing(particles, framesize, config)
+
+        self.every = self.step(1) - self.step(0) if len(self) > 1 else 1 # The steps between two records
+
+        # Reading the whole file for the exact ranges would take as long as reading the file, so they are estimated
+        if len(self):
+            sample = self.trajectory[np.unique(np.linspace(0, len(self) - 1, self.SAMPLES).astype(np.int64))]
+            velocities = np.hypot(sample["velocities"][..., 0], sample["velocities"][..., 1])
+            accelerations = np.hypot(sample["accelerations"][..., 0], sample["accelerations"][..., 1])
+            if velocities.size:
+                self.simulation.minVelocity = float(velocities.min())
+                self.simulation.maxVelocity = float(velocities.max())
+                self.simulation.minAcceleration = float(accelerations.min())
+                self.simulation.maxAcceleration = float(accelerations.max())
+
+    def __len__(self) -> int:
+        return len(self.trajectory)
+
+    def step(self, index: int) -> int:
+        return int(self.trajectory["step"][index])
+
+    def load_record(self, index: int) -> None:
+        record = self.trajectory[index]
+        store: ParticleStore = self.simulation.store
+        store.x[:], store.y[:] = record["positions"][:, 0], record["positions"][:, 1]
+        store.vx[:], store.vy[:] = record["velocities"][:, 0], record["velocities"][:, 1]
+        store.ax[:], store.ay[:] = record["accelerations"][:, 0], record["accelerations"][:, 1]
+        self.simulation.state_changed()
+
+    def history_records(self, index: int) -> np.ndarray:
+        # The indices of the records a history of the simulation would keep at this one, in chronological order: the
+        # last ones in full, and before them the ones at the steps the decimated history keeps
+        history = self.simulation.history
+        recent = np.arange(max(0, index - history.recent.capacity + 1), index + 1)
+        period = math.lcm(history.decimation, self.every) # In steps, between the decimated records in the file
+        last = self.step(recent[0]) - 1
+        last -= last % period
+        if history.older.capacity == 0 or last < self.step(0):
+            return recent
+        first = max(last - (history.older.capacity - 1) * period, self.step(0))
+        first += -first % period
+        older = (np.arange(first, last + 1, period) - self.step(0)) // self.every
+        return np.concatenate((older, recent))
+
+    def render(self,
+               index: int,
+               draw_velocity_vectors: bool,
+               draw_barycenter: bool,
+               draw_trails: bool,
+               dependent_coloring: bool,
+               dependent_coloring_type: str,
+               labelled_ids: Iterable[int] = ()) -> Frame:
+        simulation = self.simulation
+        history = simulation.history
+        history.clear() # Refill the history with the records before this one
+        if draw_trails:
+            history.allocate() # The ranges depend on the full length of the history
+            records = self.trajectory[self.history_records(index)] # One read of the file for all of them
+            history.extend(records["step"], records["positions"], records["velocities"], records["accelerations"])
+            self.load_record(index)
+        else:
+            self.load_record(index)
+            history.recent.push(self.step(index), simulation.store)
+
+        simulation.frameCounter = self.step(index)
+        simulation.time = float(self.trajectory["time"][index])
+        return simulation.render(draw_velocity_vectors=draw_velocity_vectors,
+                                 draw_barycenter=draw_barycenter,
+                                 draw_trails=draw_trails,
+                                 dependent_coloring=dependent_coloring,
+                                 dependent_coloring_type=dependent_coloring_type,
+                                 labelled_ids=labelled_ids)
@@ -1,181 +1,329 @@
-from typing import List
+import math
+from typing import Iterable, List
 
+import numpy as np
+
+from Diagnostics import Diagnostics
+from Frames import Frame, FramePool
+from History import History
 from Particle import Particle
+from ParticleStore import ParticleStore
+from Trajectory import TrajectoryWriter
+from Integrators import make_integrator
+from Heatmap import bodies_field, uses_multipole
+from Multipole import MultipoleSolver
+from ParticleMesh import ParticleMeshSolver
+from Physics import make_solver
+from Profiler import FrameProfiler
+from Rasterizer import BatchRasterizer, pack_colors
 from Vector2D import Vector2D
 from json import load
-from PIL import Image, ImageDraw
-from PIL.ImageQt import ImageQt
 
 
 class Simulation(object):
-    def __init__(self, particles: List[Particle], framesize: tuple[int, int]) -> None:
-        with open('config.json') as config: # Load the config file
-            self.config = load(config)
+    TRAIL_BATCH = 1 << 16 # The most trail segments drawn at once, they take about 100 bytes each per pixel of length
+
+    def __init__(self, particles: List[Particle], framesize: tuple[int, int], config: dict = None, physics: bool = True) -> None:
+        # Without `physics` the simulation only draws states set from the outside: it has no backend and cannot advance.
+        # The history only keeps the newest step until the trails are drawn, then it takes their memory
+        if config is None:
+            with open('config.json') as f: # Load the config file
+                config = load(f)
+        self.config = config
 
-        self.frameCounter = 0
-        self.particles = particles
+        self.frameCounter = 0 # The number of steps made
+        self.time = 0. # The simulation time passed, the sum of the steps
+        self.store = ParticleStore.from_particles(particles) # The physics works on the arrays of the store
+        self.solver = make_solver(self.config["SIMULATION"]) if physics else None # The backend that calculates the accelerations
+        self.integrator = make_integrator(self.config["SIMULATION"]) if physics else None
+        self.dt = float(self.config["SIMULATION"].get("dt", 1.))
         self.framesize = framesize
-        self.frameImage = Image.new("RGB", framesize, tuple(self.config["DRAWING"]["background_color"]))
-        self.frameDraw = ImageDraw.Draw(self.frameImage)
-        self.calculatedPositions = []
-        self.positionLog = [[x.position for x in self.particles]]
-        self.velocityLog = [[x.velocity.len() for x in self.particles]]
-        self.accelerationLog = [[0 for x in self.particles]]
-        self.maxVelocity = max(self.velocityLog[0])
-        self.minVelocity = min(self.velocityLog[0])
+        self.frames = FramePool(framesize) # The buffers render draws into, reused once the shown frames are released
+        self.rasterizer = BatchRasterizer(framesize)
+        self.profiler = FrameProfiler.from_config(self.config["DRAWING"]) # Times the stages of the frames
+        self.trailLayer = np.zeros((framesize[1], framesize[0]), dtype=np.float32) # The brightness of the trails, 255 is trail_color
+        self.trailLevels = np.zeros((framesize[1], framesize[0]), dtype=np.float32) # The brightness rounded to 0-255, reused by render
+        self.trailIndex = np.zeros((framesize[1], framesize[0]), dtype=np.uint8)
+        self.heatmapSolver = None # Evaluates the heatmap of many bodies approximately
+        self.trailStep = None # The step the trail layer was last brought up to, None if it has to be drawn anew
+        self.cachedDiagnostics = None # The diagnostics of the current step, once they are calculated
+        self.history = History.from_config(len(self.store), self.config["SIMULATION"], allocated=False) # The states of the past steps
+        self.history.record(self.frameCounter, self.store)
+        self.trajectory = None # Streams the steps to a file if it is set
+        if self.config["SIMULATION"].get("trajectory_file"):
+            self.stream_to(self.config["SIMULATION"]["trajectory_file"], int(self.config["SIMULATION"].get("trajectory_every", 1)))
+        self.maxVelocity = float(self.store.speeds().max()) if len(self.store) else 0.
+        self.minVelocity = float(self.store.speeds().min()) if len(self.store) else 0.
         self.maxAcceleration = 0.
         self.minAcceleration = 0.
 
+    @classmethod
+    def for_drawing(cls, particles: List[Particle], framesize: tuple[int, int], config: dict = None, physics: bool = False):
+        # A simulation that only draws states set from the outside, e.g. the records of a replay. It does not record
+        # a trajectory file, and its history keeps only the steps the trails still show. With `physics` it has a
+        # backend, so that it can be advanced later
+        if config is None:
+            with open('config.json') as f:
+                config = load(f)
+        simulation = dict(config["SIMULATION"], trajectory_file="", **trail_history(config))
+        return cls(particles, framesize, dict(config, SIMULATION=simulation), physics)
+
+    @property
+    def particles(self) -> List[Particle]: # Particle objects reflecting the current state, for the GUI and SaveLoad
+        return self.store.to_particles()
+
+    def diagnostics(self) -> Diagnostics:
+        # The barycenter, total mass and momentum of the current step, calculated at most once per step
+        if self.cachedDiagnostics is None or self.cachedDiagnostics.step != self.frameCounter:
+            self.cachedDiagnostics = Diagnostics.from_store(self.frameCounter, self.store)
+        return self.cachedDiagnostics
+
+    def state_changed(self) -> None:
+        # Called when the bodies were set from the outside, e.g. by a snapshot or a replay: the integrator calculates
+        # anew the accelerations it keeps between the steps, and the diagnostics are not reused
+        if self.integrator is not None:
+            self.integrator.reset()
+        self.cachedDiagnostics = None
+
     def run_step(self,
                  draw_velocity_vectors: bool,
                  draw_barycenter: bool,
                  draw_trails: bool,
                  dependent_coloring: bool,
-                 dependent_coloring_type: str) -> ImageQt:
-
-        # Calculate accelerations for all particles
-        self.velocityLog.append([]) # Add new rows for the data to be saved to
-        self.accelerationLog.append([])
-        for attracted in self.particles: # For every particle in the list...
-            for attractor in self.particles: # For each other particle...
-                distance: Vector2D = attractor.position - attracted.position # Get the distance between particles
-                try:
-                    acceleration = distance.stretch(attractor.mass / pow(distance.len(), 2)) # Calculate the acceleration
-                    attracted.velocity += acceleration
-                    attracted.acceleration = acceleration
-                except ZeroDivisionError:
-                    continue
-            self.maxVelocity = max(self.maxVelocity, attracted.velocity.len()) # Update min/max values
-            self.minVelocity = min(self.minVelocity, attracted.velocity.len())
-            self.maxAcceleration = max(self.maxAcceleration, attracted.acceleration.len())
-            self.minAcceleration = min(self.minAcceleration, attracted.acceleration.len())
-            self.velocityLog[-1].append(attracted.velocity.len()) # Save the info about current step
-            self.accelerationLog[-1].append(attracted.acceleration.len())
-            self.calculatedPositions.append(attracted.position + attracted.velocity) # Save the calculated position
-
-        for i in range(len(self.particles)): # Move particles
-            self.particles[i].position = self.calculatedPositions[i]
-        self.positionLog.append(self.calculatedPositions)
-        self.calculatedPositions = []
-
-        # Draw new frame
-        self.frameDraw.rectangle(((0, 0), self.framesize),
-                                 tuple(self.config["DRAWING"]["background_color"]))  # Clear the frame
-
-        if draw_trails:
-            for i in range(len(self.positionLog)): # For each body...
-                if i == 0:
-                    continue
-                for j in range(len(self.positionLog[i])): # Draw the line between it's position on every consecutive frames
-                    self.frameDraw.line(xy=((self.positionLog[i][j].x + self.framesize[0] // 2,
-                                             self.positionLog[i][j].y + self.framesize[0] // 2),
-                                            (self.positionLog[i - 1][j].x + self.framesize[0] // 2,
-                                             self.positionLog[i - 1][j].y + self.framesize[0] // 2)),
-                                        fill=tuple(map(lambda x: min(int(x * pow(self.config["DRAWING"]["trails_fade"], # Make the trail fade over time
-                                                                                 len(self.positionLog) - i)), 255),
-                                                       self.config["DRAWING"]["trail_color"])))
-
-        for particle in self.particles:
-            if dependent_coloring:
-                match dependent_coloring_type:
-                    case "velocity":
-                        interpolated_velocity = translate(particle.velocity.len(), self.minVelocity, self.maxVelocity) # Interpolate the velocity to 0-1 range
-                        c1 = self.config["DRAWING"]["velocity_gradient_color_0"]
-                        c2 = self.config["DRAWING"]["velocity_gradient_color_1"]
-                        color = [0, 0, 0]
-                        for comp in range(3):
-                            color[comp] = int(c1[comp] + interpolated_velocity * (c2[comp] - c1[comp])) # Interpolate the velocity between every component of c1 and c2
-                    case "acceleration":
-                        interpolated_acceleration = translate(particle.acceleration.len(), # The same procedure, but with the acceleration
-                                                              self.minAcceleration,
-                                                              self.maxAcceleration)
-                        c1 = self.config["DRAWING"]["acceleration_gradient_color_0"]
-                        c2 = self.config["DRAWING"]["acceleration_gradient_color_1"]
-                        color = [0, 0, 0]
-                        for comp in range(3):
-                            color[comp] = int(c1[comp] + interpolated_acceleration * (c2[comp] - c1[comp]))
-                    case _:
-                        color = self.config["DRAWING"]["particle_color"] # In case dependent_coloring_type does not fall into one of the cases just use the default color
+                 dependent_coloring_type: str,
+                 labelled_ids: Iterable[int] = ()) -> Frame:
+        # One step and its frame
+        self.advance(1)
+        return self.render(draw_velocity_vectors=draw_velocity_vectors,
+                           draw_barycenter=draw_barycenter,
+                           draw_trails=draw_trails,
+                           dependent_coloring=dependent_coloring,
+                           dependent_coloring_type=dependent_coloring_type,
+                           labelled_ids=labelled_ids)
+
+    def advance(self, n_steps: int = 1) -> None:
+        # Make several steps without drawing anything, e.g. the substeps between two displayed frames
+        for _ in range(n_steps):
+            self.integrator.step(self.store, self.solver, self.dt) # Calculate the accelerations, update the velocities and move the particles
+            self.record_step()
+
+    def record_step(self) -> None:
+        store = self.store
+        velocities = store.speeds() # Save the info about current step
+        accelerations = store.acceleration_magnitudes()
+        if len(store):
+            self.maxVelocity = max(self.maxVelocity, float(velocities.max())) # Update min/max values
+            self.minVelocity = min(self.minVelocity, float(velocities.min()))
+            self.maxAcceleration = max(self.maxAcceleration, float(accelerations.max()))
+            self.minAcceleration = min(self.minAcceleration, float(accelerations.min()))
+        self.frameCounter += 1
+        self.time += self.dt
+        self.history.record(self.frameCounter, store)
+        if self.trajectory is not None:
+            self.trajectory.append(self.frameCounter, self.time, store)
+
+    def stream_to(self, filename: str, every: int = 1) -> None:
+        # Write the steps that are multiples of n to a trajectory file from now on, the current one too if it is one.
+        # The records stay on the multiples, so that a replay finds a step from its index
+        self.close()
+        self.trajectory = TrajectoryWriter(filename, self.store, every)
+        self.trajectory.append(self.frameCounter, self.time, self.store)
+
+    def close(self) -> None:
+        # Finish writing the trajectory file
+        if self.trajectory is not None:
+            self.trajectory.close()
+            self.trajectory = None
+
+    def render(self,
+               draw_velocity_vectors: bool,
+               draw_barycenter: bool,
+               draw_trails: bool,
+               dependent_coloring: bool,
+               dependent_coloring_type: str,
+               labelled_ids: Iterable[int] = ()) -> Frame:
+        # Draw the current state, without advancing it. All the bodies are drawn at once into a buffer of the frame
+        # pool, which the returned frame shows without a copy: release it when it is not shown anymore. With more
+        # than lod_bodies bodies the level of detail mode draws the small bodies as single pixels or as a density
+        # map, the ids of only the heaviest bodies and of labelled_ids (e.g. the selected ones), and only some of
+        # the velocity vectors
+        drawing = self.config["DRAWING"]
+        profiler = self.profiler
+        result = self.frames.acquire()
+        frame = result.pixels
+        store = self.store
+        lod = len(store) > int(drawing.get("lod_bodies", 5000))
+        with profiler.section("render.trails"):
+            if draw_trails:
+                self.history.allocate() # Once, the history only kept the newest step so far
+                self.update_trails(self.lod_stride(int(drawing.get("lod_trails", 1000))) if lod else 1)
+                # Put the trails under the bodies: the brightness of the layer picks a color between the background and the trail color
+                np.clip(self.trailLayer, 0, 255, out=self.trailLevels)
+                np.rint(self.trailLevels, out=self.trailLevels)
+                np.copyto(self.trailIndex, self.trailLevels, casting="unsafe")
+                np.take(pack_colors(self.trail_colors()), self.trailIndex, out=frame)
+            else:
+                frame[:] = pack_colors(drawing["background_color"]) # Clear the frame
+                self.trailStep = None # The layer is not kept up to date while the trails are hidden
+
+        x = self.framesize[0] // 2 + store.x # Translate the particle coordinates to the frame's coordinate system
+        y = self.framesize[1] // 2 + store.y
+        with profiler.section("render.bodies"):
+            colors = self.body_colors(dependent_coloring, dependent_coloring_type)
+            if lod:
+                small = store.radius < float(drawing.get("lod_radius", 1.5)) # Less than a few pixels across
+                if drawing.get("lod_small_bodies", "density") == "density":
+                    self.rasterizer.draw_density(frame, x[small], y[small], colors[small])
+                else:
+                    self.rasterizer.draw_points(frame, x[small], y[small], colors[small])
+                large = ~small
+                self.rasterizer.draw_discs(frame, x[large], y[large], store.radius[large], colors[large])
             else:
-                color = self.config["DRAWING"]["particle_color"]
-
-            pos: Vector2D = Vector2D(self.framesize[0] // 2, self.framesize[1] // 2) + particle.position # Translate the particle coordinates to the frame's coordinate system
-            self.frameDraw.ellipse(xy=((pos.x - particle.radius, # Draw the particle
-                                        pos.y - particle.radius),
-                                       (pos.x + particle.radius,
-                                        pos.y + particle.radius)),
-                                   fill=tuple(color))
-
-            self.frameDraw.text((pos.x, # Render it's id
-                                 pos.y),
-                                str(particle.id),
-                                fill=tuple(self.config["DRAWING"]["particle_label_color"]))
-
-            if draw_velocity_vectors:
-                self.frameDraw.line(xy=((pos.x, pos.y), # Draw the line between particle's position on this frame and the next frame assuming that velocity does not change
-                                        (pos.x + particle.velocity.x * (self.config["DRAWING"]["vel_vect_multiplier"]), # multiply the velocity, so the line is easier to be seen
-                                         pos.y + particle.velocity.y * (
-                                             self.config["DRAWING"]["vel_vect_multiplier"]))),
-                                    fill=tuple(self.config["DRAWING"]["velocity_vectors_color"]))
-
-            if draw_barycenter:
-                barycenter_position: Vector2D = sum([particle.position * particle.mass for particle in self.particles], #Find the average position weighted by mass
-                                                    Vector2D(0, 0)) / sum(
-                    [particle.mass for particle in self.particles])
-                barycenter_position = Vector2D(self.framesize[0] // 2, self.framesize[1] // 2) + barycenter_position # Translate to frame's coordinate system
-                self.frameDraw.ellipse(xy=(barycenter_position.x - 5,
-                                           barycenter_position.y - 5,
-                                           barycenter_position.x + 5,
-                                           barycenter_position.y + 5),
-                                       fill=tuple(self.config["DRAWING"]["barycenter_color"])) # Draw the barycenter at that coordinates
-
-        return ImageQt(self.frameImage) # Return the frame image
-
-    def draw_force_heatmap(self) -> ImageQt:
-        # Calculate the force applied to every pixel of the frame
-        min_force = 1000000
-        max_force = -1
-        field = [0] * self.framesize[0] * self.framesize[1]
-        for i in range(self.framesize[0]):
-            for j in range(self.framesize[1]):
-                forces = []
-                for body in self.particles:
-                    distance = body.position - Vector2D(i, j) + Vector2D(self.framesize[0] // 2, self.framesize[1] // 2)
-                    try:
-                        forces.append(
-                            distance.stretch(body.mass / pow(max(distance.len(), body.radius), 2))
-                        )
-                    except ZeroDivisionError:
-                        pass
-                force = sum(forces, Vector2D(0, 0)).len()
-                field[i * self.framesize[1] + j] = force
-                min_force = min(min_force, force)
-                max_force = max(max_force, force)
-
-        # Map all the values to a range from 0 to 1
-        field = list(map(lambda x: translate(x, min_force, max_force) ** 0.2, field))
-
-        # Color the pixels:
-        for i in range(self.framesize[0] * self.framesize[1]):
-
-            c1 = self.config["DRAWING"]["heatmap_gradient_color_0"]
-            c2 = self.config["DRAWING"]["heatmap_gradient_color_1"]
-            color = [0, 0, 0]
-            for component in range(3):
-                color[component] = int(
-                    c1[component] + (field[i] * (c2[component] - c1[component]))
-                )
-            self.frameImage.putpixel(xy=(i // self.framesize[0],
-                                         i % self.framesize[1]), value=tuple(color))
-
-        return ImageQt(self.frameImage)
-
-
-def translate(value, Min, Max):
-    # Figure out how 'wide' each range is
-    span = Max - Min
-
-    # Convert the left range into a 0-1 range (float)
-    value_scaled = float(value - Min) / float(span)
-
-    return value_scaled
+                self.rasterizer.draw_discs(frame, x, y, store.radius, colors)
+        with profiler.section("render.labels"):
+            labelled = self.labelled_bodies(labelled_ids) if lod else slice(None)
+            self.rasterizer.draw_labels(frame, x[labelled], y[labelled], store.id[labelled], drawing["particle_label_color"]) # Render their ids
+        if draw_velocity_vectors: # Draw the lines between particles' positions on this frame and the next frame assuming that velocity does not change
+            with profiler.section("render.vectors"):
+                every = self.lod_stride(int(drawing.get("lod_velocity_vectors", 1000))) if lod else 1
+                x, y = x[::every], y[::every]
+                self.rasterizer.draw_lines(frame, x, y,
+                                           x + store.vx[::every] * drawing["vel_vect_multiplier"], # multiply the velocity, so the line is easier to be seen
+                                           y + store.vy[::every] * drawing["vel_vect_multiplier"],
+                                           drawing["velocity_vectors_color"])
+
+        if draw_barycenter and self.diagnostics().total_mass > 0:
+            barycenter_position = Vector2D(self.framesize[0] // 2, self.framesize[1] // 2) + self.diagnostics().barycenter # Translate to frame's coordinate system
+            self.rasterizer.draw_disc(frame, barycenter_position.x, barycenter_position.y, 5, drawing["barycenter_color"])
+
+        return result # Return the frame image
+
+    def lod_stride(self, limit: int) -> int:
+        # Every n-th body is drawn so that at most `limit` are, in the level of detail mode. Always the same ones, so
+        # that the subsampled vectors and trails do not flicker
+        return max(1, -(-len(self.store) // max(limit, 1)))
+
+    def labelled_bodies(self, labelled_ids: Iterable[int] = ()) -> np.ndarray:
+        # The indices of the bodies whose ids are drawn in the level of detail mode, in the order of the store: the
+        # lod_labels most massive ones and the ones in labelled_ids
+        store = self.store
+        count = int(self.config["DRAWING"].get("lod_labels", 50))
+        heaviest = np.argpartition(-store.mass, count)[:count] if count < len(store) else np.arange(len(store))
+        return np.union1d(heaviest, np.flatnonzero(np.isin(store.id, np.fromiter(labelled_ids, dtype=np.int64))))
+
+    def body_colors(self, dependent_coloring: bool, dependent_coloring_type: str) -> np.ndarray:
+        # The colors of the bodies, shape (bodies, 3): the particle color, or a gradient by the speed or the acceleration
+        drawing = self.config["DRAWING"]
+        match dependent_coloring_type if dependent_coloring else None:
+            case "velocity":
+                values = np.hypot(*self.history.latest("velocities").T)
+                low, high = self.minVelocity, self.maxVelocity
+                c1, c2 = drawing["velocity_gradient_color_0"], drawing["velocity_gradient_color_1"]
+            case "acceleration":
+                values = np.hypot(*self.history.latest("accelerations").T)
+                low, high = self.minAcceleration, self.maxAcceleration
+                c1, c2 = drawing["acceleration_gradient_color_0"], drawing["acceleration_gradient_color_1"]
+            case _: # In case dependent_coloring_type does not fall into one of the cases just use the default color
+                return np.tile(np.array(drawing["particle_color"], dtype=np.uint8), (len(self.store), 1))
+        level = (values - low) / (high - low) if high > low else np.zeros(len(values)) # Interpolate to 0-1 range
+        c1, c2 = np.array(c1, dtype=np.float64), np.array(c2, dtype=np.float64)
+        return (c1 + level[:, np.newaxis] * (c2 - c1)).astype(np.uint8) # Between every component of c1 and c2
+
+    def trail_colors(self) -> np.ndarray:
+        # The color of every brightness of the trail layer, blended like PIL's Image.paste with a mask, shape (256, 3)
+        drawing = self.config["DRAWING"]
+        alpha = np.arange(256)[:, np.newaxis]
+        background = np.array(drawing["background_color"], dtype=np.int64)
+        trail = np.array(drawing["trail_color"], dtype=np.int64)
+        return ((trail * alpha + background * (255 - alpha) + 127) // 255).astype(np.uint8)
+
+    def update_trails(self, every: int = 1) -> None:
+        # Bring the trail layer up to the current step: fade what it already has as a whole, then draw only the
+        # segments of the steps made since. It is drawn anew from the history when it cannot be continued. Only
+        # every n-th body gets a trail, this is n. The segments are drawn by the rasterizer, TRAIL_BATCH at a time
+        fade = self.config["DRAWING"]["trails_fade"]
+        steps, positions = self.history.segments("positions")
+        if self.trailStep is None or not self.history.recent_start() <= self.trailStep <= self.frameCounter:
+            self.trailLayer.fill(0.)
+            since = None
+        else:
+            if fade != 1 and self.frameCounter > self.trailStep:
+                self.trailLayer *= fade ** (self.frameCounter - self.trailStep) # Make the trails fade over time
+            since = self.trailStep
+
+        all_steps = np.concatenate(steps)
+        first = 0 if since is None else int(np.searchsorted(all_steps, since)) # From the last drawn position on
+        parts, offset = [], 0
+        for segment in positions: # The positions of the bodies with trails from the first step on, as one array
+            if first - offset < len(segment):
+                parts.append(segment[max(first - offset, 0):, ::every])
+            offset += len(segment)
+        if len(all_steps) - first < 2:
+            self.trailStep = self.frameCounter
+            return
+        center_x, center_y = self.framesize[0] // 2, self.framesize[1] // 2
+        positions = np.concatenate(parts)
+        brightness = np.minimum(255 * np.power(fade, self.frameCounter - all_steps[first + 1:] + 1.), 255)
+        batch = max(1, self.TRAIL_BATCH // positions.shape[1]) # Steps per call of the rasterizer
+        for start in range(1, len(positions), batch): # The line between the positions on every step and the previous one
+            current = positions[start:start + batch]
+            previous = positions[start - 1:start - 1 + len(current)]
+            self.rasterizer.draw_segments(self.trailLayer,
+                                          (current[..., 0] + center_x).ravel(), (current[..., 1] + center_y).ravel(),
+                                          (previous[..., 0] + center_x).ravel(), (previous[..., 1] + center_y).ravel(),
+                                          np.repeat(brightness[start - 1:start - 1 + len(current)], positions.shape[1]).astype(np.float32))
+        self.trailStep = self.frameCounter
+
+    def heatmap_field(self, pixel_x: np.ndarray, pixel_y: np.ndarray) -> np.ndarray:
+        # The value shown by the heatmap on the grid pixel_x x pixel_y, shape (len(pixel_x), len(pixel_y)): the
+        # magnitude of the field, or the depth of the potential (-potential), depending on DRAWING.heatmap_field
+        drawing = self.config["DRAWING"]
+        potential = drawing.get("heatmap_field", "force") == "potential"
+        method = drawing.get("heatmap_method", "auto")
+        store = self.store
+        if self.samples_heatmap(): # The grid of the particle-mesh backend already holds the field
+            if self.solver.field_x is None: # No step was made yet
+                self.solver.solve(store.x, store.y, store.mass)
+            grid_x, grid_y = pixel_x[:, np.newaxis], pixel_y[np.newaxis, :]
+            if potential:
+                return -self.solver.sample(self.solver.potential, grid_x, grid_y)
+            return np.hypot(self.solver.sample(self.solver.field_x, grid_x, grid_y),
+                            self.solver.sample(self.solver.field_y, grid_x, grid_y))
+        solver = None
+        if uses_multipole(method, len(store)):
+            order = int(drawing.get("heatmap_fmm_order", 4))
+            if self.heatmapSolver is None or self.heatmapSolver.order != order:
+                self.heatmapSolver = MultipoleSolver(order=order)
+            solver = self.heatmapSolver
+        return bodies_field(pixel_x, pixel_y, store.x, store.y, store.mass, store.radius, potential, solver)
+
+    def samples_heatmap(self) -> bool:
+        # The heatmap is read from the grid of the particle-mesh backend instead of being summed over the bodies
+        return isinstance(self.solver, ParticleMeshSolver)
+
+    def heatmap_colors(self, field: np.ndarray, value_range: tuple[float, float] = None) -> np.ndarray:
+        # Map the field to the gradient between the two heatmap colors, as an image array of shape (y, x, 3). The
+        # range of the values is the one of the field, unless another one is given (the values outside it are clipped)
+        min_force, max_force = (float(field.min()), float(field.max())) if value_range is None else value_range
+        level = np.zeros(field.shape)
+        if max_force > min_force:
+            level = np.clip((field - min_force) / (max_force - min_force), 0., 1.) ** 0.2 # Map all the values to a range from 0 to 1
+        c1 = np.array(self.config["DRAWING"]["heatmap_gradient_color_0"], dtype=np.float64)
+        c2 = np.array(self.config["DRAWING"]["heatmap_gradient_color_1"], dtype=np.float64)
+        colors = (c1 + level[..., np.newaxis] * (c2 - c1)).astype(np.uint8)
+        return np.ascontiguousarray(colors.transpose(1, 0, 2)) # The field is indexed by x first, the image by y
+
+
+def trail_history(config: dict) -> dict:
+    # The history settings that keep only the steps of the trails that can still be seen. A segment drawn k steps ago
+    # has the brightness 255 * trails_fade^(k + 1), which rounds to nothing after `visible` steps
+    length = int(config["SIMULATION"].get("history_length", 1000))
+    decimation = max(int(config["SIMULATION"].get("history_decimation", 10)), 1)
+    decimated_length = int(config["SIMULATION"].get("history_decimated_length", 1000))
+    fade = float(config["DRAWING"]["trails_fade"])
+    if fade >= 1:
+        return dict(history_length=length, history_decimated_length=decimated_length)
+    visible = math.ceil(math.log(0.5 / 255) / math.log(fade)) if fade > 0 else 1
+    before = max(visible + 1 - length, 0) # The visible steps before the recent window, of which every n-th is kept
+    return dict(history_length=min(length, visible + 1),
+                history_decimated_length=min(decimated_length, math.ceil(before / decimation) + 1 if before else 0))
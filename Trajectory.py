@@ -0,0 +1,133 @@
+import os
+from queue import Queue, Empty
+from threading import Thread
+from typing import List
+
+import numpy as np
+
+from Particle import Particle
+from ParticleStore import ParticleStore
+from SaveLoad import load_initial_state, save_initial_state
+
+
+# A trajectory file is a valid .npy file holding a one-dimensional array of records, one per saved step, with the
+# fields step, time, positions, velocities and accelerations (the last three of shape (bodies, 2), the bodies in the
+# order of the store). Records are only appended, and the shape in the header is updated after every written chunk,
+# so the file can be read while the simulation still runs, or after it crashed. The bodies themselves (ids, masses
+# and radii) are in a save file next to it, holding the state the file was started at
+
+MAGIC = b"\x93NUMPY\x01\x00" # Format version 1.0
+HEADER_LENGTH = 4096 # Reserved, so that the header can be rewritten in place when the number of records grows
+CHUNK_BYTES = 4 * 1024 * 1024 # The size of the chunks the records are written in
+
+
+def bodies_filename(filename: str) -> str:
+    return os.path.splitext(filename)[0] + ".bodies.json"
+
+
+def record_dtype(count: int) -> np.dtype:
+    return np.dtype([("step", np.int64),
+                     ("time", np.float64),
+                     ("positions", np.float64, (count, 2)),
+                     ("velocities", np.float64, (count, 2)),
+                     ("accelerations", np.float64, (count, 2))])
+
+
+def encode_header(dtype: np.dtype, records: int) -> bytes:
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (np.lib.format.dtype_to_descr(dtype), records)
+    header = header.ljust(HEADER_LENGTH - len(MAGIC) - 2 - 1) + "\n"
+    return MAGIC + len(header).to_bytes(2, "little") + header.encode("latin1")
+
+
+class TrajectoryWriter(object):
+    # Collects the records into chunks in the simulation thread and writes them in a background thread, so the
+    # physics never waits for the disk. Buffers of written chunks are reused, a new one is only allocated if the disk
+    # falls behind
+    def __init__(self, filename: str, store: ParticleStore, every: int = 1) -> None:
+        self.dtype = record_dtype(len(store))
+        if len(encode_header(self.dtype, 0)) > HEADER_LENGTH:
+            raise ValueError(f"Too many bodies for a trajectory file: {len(store)}")
+        save_initial_state(store.to_particles(), bodies_filename(filename))
+        self.every = max(every, 1) # Only the steps that are multiples of it are saved
+        self.chunk_records = max(1, CHUNK_BYTES // self.dtype.itemsize)
+        self.use_chunk(np.zeros(self.chunk_records, dtype=self.dtype))
+        self.written = 0 # The number of records in the file, only changed by the writer thread
+        self.error = None # An exception of the writer thread, raised in the simulation thread
+        self.file = open(filename, "wb")
+        self.file.write(encode_header(self.dtype, 0))
+        self.pending = Queue() # (chunk, number of records) to write, None stops the thread
+        self.free = Queue() # Written chunks that can be filled again
+        self.thread = Thread(target=self.write_cycle, daemon=True)
+        self.thread.start()
+
+    def append(self, step: int, time: float, store: ParticleStore) -> None:
+        if step % self.every != 0:
+            return
+        if self.error is not None:
+            raise self.error
+        row = self.filled
+        fields = self.fields
+        fields["step"][row] = step
+        fields["time"][row] = time
+        fields["positions"][row, :, 0], fields["positions"][row, :, 1] = store.x, store.y
+        fields["velocities"][row, :, 0], fields["velocities"][row, :, 1] = store.vx, store.vy
+        fields["accelerations"][row, :, 0], fields["accelerations"][row, :, 1] = store.ax, store.ay
+        self.filled += 1
+        if self.filled == self.chunk_records:
+            self.flush()
+
+    def flush(self) -> None:
+        # Pass the current chunk to the writer thread, even if it is not full
+        if self.filled == 0:
+            return
+        self.pending.put((self.chunk, self.filled))
+        try:
+            self.use_chunk(self.free.get_nowait())
+        except Empty:
+            self.use_chunk(np.zeros(self.chunk_records, dtype=self.dtype))
+
+    def use_chunk(self, chunk: np.ndarray) -> None:
+        self.chunk = chunk
+        self.fields = {name: chunk[name] for name in self.dtype.names} # Views, looked up once per chunk
+        self.filled = 0 # The number of records in the current chunk
+
+    def write_cycle(self) -> None:
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            chunk, records = item
+            if self.error is None:
+                try:
+                    self.file.write(memoryview(chunk[:records]).cast("B")) # Without a copy
+                    self.written += records
+                    self.file.seek(0) # Make the new records visible to the readers
+                    self.file.write(encode_header(self.dtype, self.written))
+                    self.file.seek(0, 2)
+                    self.file.flush()
+                except OSError as exception:
+                    self.error = exception
+            self.free.put(chunk)
+
+    def close(self) -> None:
+        if self.file.closed:
+            return
+        self.flush()
+        self.pending.put(None)
+        self.thread.join()
+        self.file.close()
+        if self.error is not None:
+            raise self.error
+
+
+def open_trajectory(filename: str) -> np.memmap:
+    # Memory-map a trajectory file for reading. Fields are accessed by name, e.g. trajectory["positions"][1000:2000]
+    # has the shape (1000, bodies, 2), and only the pages that are used are read from the disk
+    return np.load(filename, mmap_mode="r")
+
+
+def load_bodies(filename: str) -> List[Particle]:
+    # The bodies of a trajectory file, in the state the file was started at. They are in a save file next to it
+    if not os.path.exists(bodies_filename(filename)):
+        raise FileNotFoundError(f"The bodies of the trajectory are missing, they are kept in {bodies_filename(filename)}")
+    return load_initial_state(bodies_filename(filename))
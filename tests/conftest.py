@@ -0,0 +1,22 @@
+import copy
+import os
+import sys
+from json import load
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT) # The modules of the simulation are at the top of the repository
+
+with open(os.path.join(ROOT, "config.json")) as f:
+    CONFIG = load(f)
+
+
+@pytest.fixture
+def config() -> dict:
+    # A copy of config.json, to be changed by the test
+    return copy.deepcopy(CONFIG)
+
+
+def save_path(name: str) -> str:
+    return os.path.join(ROOT, "saves", name)
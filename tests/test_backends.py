@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from BarnesHut import BarnesHutSolver
+from Physics import DirectSolver, make_solver
+
+# The largest median relative error of the accelerations of every backend, on a disc of bodies
+TOLERANCES = {"pairwise": 1e-12, "parallel": 1e-12, "numba": 1e-12, "barnes_hut": 2e-2, "fmm": 1e-3, "particle_mesh": 2e-2}
+
+
+def relative_errors(ax: np.ndarray, ay: np.ndarray, x: np.ndarray, y: np.ndarray, mass: np.ndarray) -> np.ndarray:
+    exact_x, exact_y = DirectSolver().accelerations(x, y, mass)
+    return np.hypot(ax - exact_x, ay - exact_y) / np.hypot(exact_x, exact_y)
+
+
+def test_barnes_hut_scattered_system():
+    # One body far away makes the grid of the tree coarse, the dense cluster still has to be split into small leaves,
+    # and the pairs of a leaf at the depth limit are summed in groups within the budget
+    rng = np.random.default_rng(0)
+    x, y, mass = rng.normal(0, 1, 3000), rng.normal(0, 1, 3000), rng.uniform(1, 2, 3000)
+    x[0] = 1e6
+    ax, ay = BarnesHutSolver(memory_budget=64 * 1024).accelerations(x, y, mass)
+    assert np.median(relative_errors(ax, ay, x, y, mass)) < 0.02
+
+    x[1:], y[1:] = rng.normal(0, 1e-9, (2, 2999)) # Closer than the finest cells, all of them in one leaf
+    ax, ay = BarnesHutSolver(memory_budget=64 * 1024).accelerations(x, y, mass)
+    assert np.median(relative_errors(ax, ay, x, y, mass)) < 1e-6
+
+
+def disc(count: int, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    radius, angle = np.sqrt(rng.uniform(0, 1, count)) * 300, rng.uniform(0, 2 * np.pi, count)
+    return radius * np.cos(angle), radius * np.sin(angle), rng.uniform(1, 10, count)
+
+
+@pytest.mark.parametrize("backend", TOLERANCES)
+def test_backend_matches_direct(config, backend):
+    x, y, mass = disc(200)
+    solver = make_solver(dict(config["SIMULATION"], backend=backend, parallel_workers=2))
+    try:
+        ax, ay = solver.accelerations(x, y, mass)
+    finally:
+        if hasattr(solver, "close"):
+            solver.close()
+    assert np.median(relative_errors(ax, ay, x, y, mass)) < TOLERANCES[backend]
+
+
+def test_barnes_hut_without_approximation():
+    # With theta = 0 every node is opened, the sums are the exact ones
+    x, y, mass = disc(500)
+    ax, ay = BarnesHutSolver(theta=0.).accelerations(x, y, mass)
+    assert relative_errors(ax, ay, x, y, mass).max() < 1e-10
+
+
+def test_direct_blocks():
+    # The result does not depend on how many attracted bodies are in one block
+    x, y, mass = disc(300)
+    ax, ay = DirectSolver(memory_budget=1).accelerations(x, y, mass)
+    assert relative_errors(ax, ay, x, y, mass).max() < 1e-12
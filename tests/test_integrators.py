@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from Integrators import make_integrator
+from Particle import Particle
+from ParticleStore import ParticleStore
+from Physics import DirectSolver
+from Vector2D import Vector2D
+
+# The order of every integrator in the energy error, and the largest relative energy error over five orbits at dt = 1
+INTEGRATORS = {"euler": (1, 3e-2), "leapfrog": (2, 1e-3), "velocity_verlet": (2, 1e-3), "rk4": (4, 1e-6),
+               "yoshida4": (4, 1e-5), "block": (None, 1e-3)}
+PERIOD = 2 * np.pi * 100 / np.sqrt(2.5) # Of the circular orbit, the eccentric one is shorter
+
+
+def orbit() -> ParticleStore:
+    # Two equal bodies on eccentric orbits around their barycenter, at 0.8 times the circular speed
+    speed = 0.8 * np.sqrt(2.5)
+    return ParticleStore.from_particles([Particle(1, Vector2D(-100, 0), Vector2D(0, -speed), 1000, 5),
+                                         Particle(2, Vector2D(100, 0), Vector2D(0, speed), 1000, 5)])
+
+
+def energy(store: ParticleStore) -> float:
+    distance = np.hypot(store.x[0] - store.x[1], store.y[0] - store.y[1])
+    return 0.5 * float(np.sum(store.mass * (store.vx ** 2 + store.vy ** 2))) - store.mass[0] * store.mass[1] / distance
+
+
+def energy_errors(name: str, dt: float, duration: float) -> np.ndarray:
+    # The relative energy error after every step
+    store, integrator, solver = orbit(), make_integrator({"integrator": name}), DirectSolver()
+    initial = energy(store)
+    errors = np.empty(int(duration / dt))
+    for step in range(len(errors)):
+        integrator.step(store, solver, dt)
+        errors[step] = abs(energy(store) - initial) / abs(initial)
+    return errors
+
+
+@pytest.mark.parametrize("name", INTEGRATORS)
+def test_energy_error(name):
+    order, tolerance = INTEGRATORS[name]
+    fine = energy_errors(name, 1., 2000.)
+    assert fine.max() < tolerance
+    if order is not None: # Halving the step divides the error by 2^order
+        coarse = energy_errors(name, 2., 2000.)
+        assert coarse.max() / fine.max() > 0.8 * 2 ** order
+
+
+@pytest.mark.parametrize("name", ["leapfrog", "velocity_verlet", "yoshida4"])
+def test_symplectic_energy_does_not_drift(name):
+    # The error of the symplectic integrators oscillates with the orbit instead of growing
+    errors = energy_errors(name, 1., 10 * PERIOD)
+    orbit_steps = int(PERIOD)
+    assert errors[-orbit_steps:].max() < 1.1 * errors[:orbit_steps].max()
@@ -0,0 +1,97 @@
+import time
+
+import numpy as np
+
+from conftest import save_path
+from Pipeline import ProcessPipeline, SimulationPipeline, Snapshot
+from SaveLoad import load_initial_state
+from Simulation import Simulation
+from Trajectory import open_trajectory
+
+OPTIONS = dict(draw_velocity_vectors=True, draw_barycenter=True, draw_trails=True, dependent_coloring=False,
+               dependent_coloring_type=None)
+
+
+def test_process_pipeline_writes_trajectory(tmp_path, config):
+    # The simulation of the GUI does not record, the child process does with the config given to the pipeline
+    filename = str(tmp_path / "run.npy")
+    config["SIMULATION"]["trajectory_file"] = filename
+    simulation = Simulation.for_drawing(load_initial_state(save_path("2_bodies_of_equal_mass.json")), (100, 100), config)
+    pipeline = ProcessPipeline.from_config(simulation, config)
+    pipeline.options = OPTIONS
+    pipeline.start()
+    deadline = time.time() + 60
+    while pipeline.drawn < 5 and time.time() < deadline:
+        time.sleep(0.05)
+    pipeline.stop()
+    assert pipeline.drawn >= 5
+
+    trajectory = open_trajectory(filename)
+    assert len(trajectory) > 1
+    assert np.array_equal(trajectory["step"], np.arange(len(trajectory)))
+    assert trajectory["step"][-1] == simulation.frameCounter
+    assert np.allclose(trajectory["positions"][-1], np.stack((simulation.store.x, simulation.store.y), axis=1))
+
+
+def run_pipeline(pipeline: SimulationPipeline, options: dict, frames: int = 5) -> None:
+    pipeline.options = options
+    pipeline.start()
+    deadline = time.time() + 60
+    while pipeline.drawn < frames and time.time() < deadline:
+        time.sleep(0.05)
+    pipeline.stop()
+    assert pipeline.drawn >= frames
+
+
+def test_pipeline_returns_history(config):
+    # While the pipeline runs only the drawing keeps the history of the trails, the simulation gets it back at the stop
+    config["SIMULATION"]["steps_per_frame"] = 3
+    simulation = Simulation(load_initial_state(save_path("2_bodies_of_equal_mass.json")), (100, 100), config)
+    pipeline = SimulationPipeline(simulation, steps_per_frame=3)
+    assert simulation.history.recent.capacity == 3
+    run_pipeline(pipeline, OPTIONS)
+
+    steps = np.concatenate(simulation.history.recent.segments(simulation.history.recent.steps))
+    assert steps[0] == 0 and steps[-1] == simulation.frameCounter
+    assert np.array_equal(np.diff(steps), np.ones(len(steps) - 1))
+    assert np.array_equal(simulation.history.latest("positions"), np.stack((simulation.store.x, simulation.store.y), axis=1))
+
+
+def test_drawing_history_is_allocated_for_trails(config):
+    # Without the trails the drawing only keeps the newest step
+    simulation = Simulation(load_initial_state(save_path("2_bodies_of_equal_mass.json")), (100, 100), config)
+    pipeline = SimulationPipeline(simulation)
+    assert pipeline.drawing.solver is None
+    run_pipeline(pipeline, dict(OPTIONS, draw_trails=False))
+    assert pipeline.drawing.history.recent.capacity == 1
+
+
+def test_simulation_history_is_allocated_when_drawn(config):
+    # A simulation that is only advanced keeps the newest step, the trails take the whole history
+    simulation = Simulation(load_initial_state(save_path("2_bodies_of_equal_mass.json")), (100, 100), config)
+    simulation.advance(5)
+    assert simulation.history.recent.capacity == 1 and simulation.history.older.capacity == 0
+    simulation.render(**OPTIONS).release()
+    assert simulation.history.recent.capacity == config["SIMULATION"]["history_length"]
+
+def test_drawing_history_is_sized_by_fade(config):
+    # With fading trails the drawing keeps only the steps that are still visible
+    config["DRAWING"]["trails_fade"] = 0.5
+    drawing = Simulation.for_drawing(load_initial_state(save_path("2_bodies_of_equal_mass.json")), (100, 100), config)
+    drawing.history.allocate()
+    assert drawing.history.recent.capacity == 10 and drawing.history.older.capacity == 0
+    assert 255 * 0.5 ** 10 < 0.5 <= 255 * 0.5 ** 8
+
+def test_snapshot_resets_integrator(config):
+    # The leapfrog keeps the accelerations of the last step, they are calculated anew after a snapshot sets the bodies
+    config["SIMULATION"]["integrator"] = "leapfrog"
+    source = Simulation(load_initial_state(save_path("2_bodies_of_different_masses.json")), (100, 100), config)
+    source.advance(10)
+    target = Simulation(load_initial_state(save_path("2_bodies_of_different_masses.json")), (100, 100), config)
+    target.advance(3)
+    assert target.integrator.ready
+    Snapshot.from_simulation(source, 0).apply(target)
+    assert not target.integrator.ready
+    source.advance(1)
+    target.advance(1)
+    assert np.allclose(target.store.x, source.store.x) and np.allclose(target.store.vy, source.store.vy)
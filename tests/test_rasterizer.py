@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from conftest import save_path
+from Particle import Particle
+from Rasterizer import BatchRasterizer
+from SaveLoad import load_initial_state
+from Simulation import Simulation
+from Vector2D import Vector2D
+
+
+def test_lines_match_imagedraw():
+    # The segments inside the frame take the pixels of ImageDraw.line
+    rng = np.random.default_rng(0)
+    x0, y0, x1, y1 = rng.integers(0, 50, (4, 500)).astype(np.float64)
+    rasterizer = BatchRasterizer((50, 50))
+    for index in range(len(x0)):
+        image = Image.new("L", (50, 50))
+        ImageDraw.Draw(image).line(xy=((x0[index], y0[index]), (x1[index], y1[index])), fill=255)
+        _, px, py = rasterizer.line_pixels(x0[index:index + 1], y0[index:index + 1], x1[index:index + 1], y1[index:index + 1])
+        drawn = np.zeros((50, 50), dtype=bool)
+        drawn[py, px] = True
+        assert np.array_equal(drawn, np.asarray(image) > 0)
+
+
+def test_trails_match_imagedraw(config):
+    # The trail layer drawn from the history in batches is the one of a line per body and step with ImageDraw
+    config["DRAWING"]["trails_fade"] = 0.99
+    simulation = Simulation(load_initial_state(save_path("2_bodies_of_equal_mass.json")), (400, 400), config)
+    simulation.history.allocate()
+    simulation.advance(300)
+    simulation.update_trails()
+
+    reference = Image.new("F", (400, 400), 0.)
+    draw = ImageDraw.Draw(reference)
+    steps, positions = (np.concatenate(segments) for segments in simulation.history.segments("positions"))
+    for index in range(1, len(steps)):
+        brightness = min(255 * 0.99 ** (simulation.frameCounter - steps[index] + 1), 255)
+        for body in range(positions.shape[1]):
+            draw.line(xy=tuple((positions[step, body, 0] + 200, positions[step, body, 1] + 200) for step in (index, index - 1)),
+                      fill=brightness)
+    assert np.allclose(simulation.trailLayer, np.asarray(reference), atol=1e-3)
+
+
+def reference_frame(simulation: Simulation, drawing: dict) -> np.ndarray:
+    # The frame drawn with ImageDraw: a disc, a label and a velocity vector per body, then the barycenter
+    image = Image.new("RGB", simulation.framesize, tuple(drawing["background_color"]))
+    draw = ImageDraw.Draw(image)
+    center_x, center_y = simulation.framesize[0] // 2, simulation.framesize[1] // 2
+    for particle in simulation.particles:
+        x, y, radius = center_x + particle.position.x, center_y + particle.position.y, particle.radius
+        draw.ellipse(xy=((x - radius, y - radius), (x + radius, y + radius)), fill=tuple(drawing["particle_color"]))
+        draw.text((x, y), str(particle.id), fill=tuple(drawing["particle_label_color"]))
+        draw.line(xy=((x, y), (x + particle.velocity.x * drawing["vel_vect_multiplier"],
+                               y + particle.velocity.y * drawing["vel_vect_multiplier"])),
+                  fill=tuple(drawing["velocity_vectors_color"]))
+    barycenter = simulation.diagnostics().barycenter
+    x, y = center_x + barycenter.x, center_y + barycenter.y
+    draw.ellipse(xy=((x - 5, y - 5), (x + 5, y + 5)), fill=tuple(drawing["barycenter_color"]))
+    return np.asarray(image)
+
+
+@pytest.mark.parametrize("offset", [0., 0.3])
+def test_frame_matches_reference(config, offset):
+    # Discs and labels are drawn by their own rasterizer, their edges may differ from ImageDraw by a pixel, but not more
+    radii = [2, 3, 5, 8, 12.5, 20]
+    particles = [Particle(index + 1, Vector2D(-250 + (index % 4) * 160 + offset, -150 + (index // 4) * 140 + offset),
+                          Vector2D((index % 3 - 1) * 3., (index % 2) * 2. - 1), 10. + index, radii[index % 6])
+                 for index in range(12)]
+    simulation = Simulation(particles, (640, 480), config)
+    frame = simulation.render(draw_velocity_vectors=True, draw_barycenter=True, draw_trails=False,
+                              dependent_coloring=False, dependent_coloring_type=None)
+    drawn = np.stack(((frame.pixels >> 16) & 255, (frame.pixels >> 8) & 255, frame.pixels & 255), axis=-1)
+    frame.release()
+    reference = reference_frame(simulation, config["DRAWING"])
+
+    different = (drawn != reference).any(axis=-1)
+    assert different.sum() < 0.03 * (reference != reference[0, 0]).any(axis=-1).sum()
+    nearby = np.zeros_like(different) # The color of a differing pixel is the one of a neighbour in the reference
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            nearby |= (np.roll(reference, (dy, dx), axis=(0, 1)) == drawn).all(axis=-1)
+    assert (different & ~nearby).sum() <= 2
@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import save_path
+from Replay import Replay
+from SaveLoad import load_initial_state
+from Simulation import Simulation
+from Trajectory import bodies_filename
+
+OPTIONS = dict(draw_velocity_vectors=False, draw_barycenter=False, draw_trails=True, dependent_coloring=False,
+               dependent_coloring_type=None)
+
+
+def record(filename: str, config: dict, steps: int, every: int) -> Simulation:
+    simulation = Simulation(load_initial_state(save_path("2_bodies_of_different_masses.json")), (100, 100), config)
+    simulation.history.allocate()
+    simulation.stream_to(filename, every)
+    simulation.advance(steps)
+    simulation.close()
+    return simulation
+
+
+def test_replay_history_matches_simulation(tmp_path, config):
+    # The history the replay loads at the last record holds the steps the simulation kept in its own
+    config["SIMULATION"].update(history_length=30, history_decimation=10, history_decimated_length=5)
+    filename = str(tmp_path / "run.npy")
+    simulation = record(filename, config, 200, 1)
+    replay = Replay(filename, (100, 100), config)
+    replay.render(len(replay) - 1, **OPTIONS).release()
+
+    steps, positions = replay.simulation.history.segments("positions")
+    expected_steps, expected_positions = simulation.history.segments("positions")
+    assert np.array_equal(np.concatenate(steps), np.concatenate(expected_steps))
+    assert np.allclose(np.concatenate(positions), np.concatenate(expected_positions))
+    assert np.allclose(replay.simulation.store.x, simulation.store.x)
+
+
+def test_replay_history_of_sparse_records(tmp_path, config):
+    # With every 3rd step recorded, the history keeps the last records in full and before them the records at the
+    # multiples of both the decimation and 3
+    config["SIMULATION"].update(history_length=20, history_decimation=10, history_decimated_length=100)
+    filename = str(tmp_path / "run.npy")
+    record(filename, config, 300, 3)
+    replay = Replay(filename, (100, 100), config)
+    replay.render(80, **OPTIONS).release()
+
+    steps = np.concatenate(replay.simulation.history.segments("positions")[0])
+    assert np.array_equal(steps[-20:], np.arange(61, 81) * 3)
+    assert np.array_equal(steps[:-20], np.arange(0, 61 * 3, 30))
+
+
+def test_replay_without_bodies_file(tmp_path, config):
+    filename = str(tmp_path / "run.npy")
+    record(filename, config, 10, 1)
+    os.remove(bodies_filename(filename))
+    with pytest.raises(FileNotFoundError):
+        Replay(filename, (100, 100), config)
+
+
+def test_stream_keeps_multiples(tmp_path, config):
+    # A file started between two multiples of `every` begins with the next multiple
+    filename = str(tmp_path / "run.npy")
+    simulation = Simulation(load_initial_state(save_path("2_bodies_of_equal_mass.json")), (100, 100), config)
+    simulation.advance(3)
+    simulation.stream_to(filename, 5)
+    simulation.advance(20)
+    simulation.close()
+    assert np.array_equal(Replay(filename, (100, 100), config).trajectory["step"], [5, 10, 15, 20])
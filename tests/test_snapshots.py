@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from Pipeline import SharedSnapshots, Snapshot
+
+BODIES = 3
+
+
+def snapshot(first: int, last: int) -> Snapshot:
+    # The steps first..last, every value of a step is the step itself
+    steps = np.arange(first, last + 1)
+    values = np.broadcast_to(steps[:, np.newaxis, np.newaxis], (len(steps), BODIES, 2)).astype(np.float64)
+    return Snapshot(steps, values, values + 0.5, values + 0.25, time=float(last),
+                    velocity_range=(0., float(last)), acceleration_range=(1., float(last)))
+
+
+@pytest.fixture
+def channel():
+    channel = SharedSnapshots(BODIES, capacity=8)
+    yield channel
+    channel.close()
+    channel.block.unlink()
+
+
+def test_write_read(channel):
+    assert channel.read(0) == (0, None) # Nothing written yet
+    assert channel.write(snapshot(1, 3))
+    sequence, read = channel.read(0)
+    assert sequence == 1
+    assert np.array_equal(read.steps, [1, 2, 3])
+    assert np.array_equal(read.positions[:, 0, 0], [1, 2, 3])
+    assert np.array_equal(read.velocities[-1], np.full((BODIES, 2), 3.5)) # Only the newest ones are kept
+    assert np.array_equal(read.accelerations[-1], np.full((BODIES, 2), 3.25))
+    assert (read.time, read.velocity_range, read.acceleration_range) == (3., (0., 3.), (1., 3.))
+    assert channel.read(sequence) == (sequence, None) # Nothing newer
+
+
+def test_unread_snapshots_are_merged(channel):
+    # The reader did not take the first snapshot, the second one brings its steps along
+    channel.write(snapshot(1, 3))
+    channel.write(snapshot(4, 6))
+    sequence, read = channel.read(0)
+    assert sequence == 2
+    assert np.array_equal(read.steps, np.arange(1, 7))
+
+    channel.write(snapshot(7, 9)) # The second one was read, nothing is merged
+    assert np.array_equal(channel.read(sequence)[1].steps, [7, 8, 9])
+
+
+def test_merged_steps_are_limited_to_capacity(channel):
+    for first in range(1, 16, 3):
+        channel.write(snapshot(first, first + 2))
+    assert np.array_equal(channel.read(0)[1].steps, np.arange(8, 16)) # The last 8 of 1..15
+
+
+def test_buffer_being_copied_is_not_overwritten(channel):
+    channel.write(snapshot(1, 3))
+    channel.write(snapshot(4, 6))
+    channel.header[2] = 1 # The reader copies the buffer of the first snapshot, which the third one would use
+    assert not channel.write(snapshot(7, 9))
+    assert channel.header[0] == 2
+    assert channel.latest().steps[-1] == 6
+    channel.header[2] = 0 # The copy is done
+    channel.flush()
+    sequence, read = channel.read(0)
+    assert sequence == 3
+    assert np.array_equal(read.steps, np.arange(2, 10)) # Merged with the unread ones, the last 8 of 1..9
+    assert np.array_equal(channel.latest().steps, read.steps)
+
+
+def test_pending_snapshot_is_merged_into_the_next(channel):
+    channel.write(snapshot(1, 3))
+    channel.read(0)
+    channel.write(snapshot(4, 5))
+    channel.header[2] = 1
+    assert not channel.write(snapshot(6, 7))
+    channel.header[2] = 0
+    assert channel.write(snapshot(8, 9)) # Takes the pending one with it
+    assert np.array_equal(channel.read(1)[1].steps, np.arange(4, 10))
+
+
+def test_torn_copy_is_discarded(channel):
+    channel.write(snapshot(1, 3))
+    channel.buffers[1]["meta"][0] = -1 # As if the writer was writing into it
+    assert channel.read(0) == (0, None)